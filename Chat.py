@@ -1,13 +1,23 @@
-import threading
 import tkinter as tk
 from datetime import datetime
+from pathlib import Path
+from queue import Full
+from threading import Thread
 from typing import Optional, Tuple
 
 from device_client import DeviceClient
+from log_sink import LogSink
+from payload_codec import decode_payload
+from profiles import GROUPS, PARAMETER_TABLE
+from protocol import Ack, Address, Config, Data, DeviceEvent, Reset, Version
+from tk_support import BoundedTextView, EventBridge
 
 
 class ChatUI(tk.Tk):
 
+	CHAT_LINES = 1000
+	HISTORY_LINES = 2000
+
 	def __init__(self):
 		super().__init__()
 		self.title("Visible Light Communication")
@@ -16,8 +26,15 @@ class ChatUI(tk.Tk):
 		self.columnconfigure(1, weight=2)
 
 		self.client = None
+		# Counts connect attempts; a worker that finishes after a newer attempt closes its client.
+		self._connect_attempt = 0
+		self._chat_archive = LogSink(Path(__file__).with_name("chat_log.txt"))
+		self.bridge = EventBridge(self)
+		self.protocol("WM_DELETE_WINDOW", self._handle_close)
 
 		self.port_var = tk.StringVar(value = "")
+		self.compression_var = tk.BooleanVar(value=False)
+		self.compression_stats_var = tk.StringVar(value="")
 		self.device_address_var = tk.StringVar(value=self.client.device_address if self.client else "00")
 		self.destination_address_var = tk.StringVar(value=self.client.destination_address if self.client else "FF")
 		self.config_group_var = tk.StringVar(value="")
@@ -51,6 +68,7 @@ class ChatUI(tk.Tk):
 		self.chat_text.tag_configure("received", background="#D3F8D3", foreground="#0A3D0A")
 		self.chat_text.tag_configure("system", background="#F0F0F0", foreground="#606060")
 
+		self.chat_view = BoundedTextView(self.chat_text, self.bridge, self.CHAT_LINES, archive=self._chat_archive)
 		self._append_chat_message("Welcome to the Visible Light Communication Chat! To find the Serial port on mac/linux use ls /dev/tty.*", False, True)
 
 		self.chat_text.grid(row=0, column=0, sticky="nsew")
@@ -80,6 +98,8 @@ class ChatUI(tk.Tk):
 
 		self.history_text = tk.Text(history_text_frame, wrap="none", state="disabled", height=10)
 		self.history_text.grid(row=0, column=0, sticky="nsew")
+		# The full device history is in the client's log file; the pane only keeps the tail.
+		self.history_view = BoundedTextView(self.history_text, self.bridge, self.HISTORY_LINES)
 
 	def _build_control_panel(self):
 		control_panel = tk.Frame(self)
@@ -96,6 +116,8 @@ class ChatUI(tk.Tk):
 		port_entry = tk.Entry(connection_box, textvariable=self.port_var)
 		port_entry.grid(row=0, column=1, sticky="ew", pady=4)
 		tk.Button(connection_box, text="Connect", command=self._handle_connect).grid(row=0, column=2, sticky="ew", padx=(8,0))
+		tk.Checkbutton(connection_box, text="Compress messages", variable=self.compression_var).grid(row=1, column=0, columnspan=2, sticky="w")
+		tk.Label(connection_box, textvariable=self.compression_stats_var, fg="#606060").grid(row=2, column=0, columnspan=3, sticky="w")
 
 		button_box = tk.Frame(control_panel)
 		button_box.grid(row=2, column=0, sticky="ew", pady=(0, 16))
@@ -141,19 +163,39 @@ class ChatUI(tk.Tk):
 		port = self.port_var.get()
 		if self.client:
 			self.client.close()
-		self.client = DeviceClient(port=port)
+			self.client = None
+		self._connect_attempt += 1
+		self.compression_stats_var.set("")
+		self._append_chat_message(f"Connecting to {port}...", False, True)
+		# Opening the port waits for the board to boot; keep that off the Tk thread.
+		Thread(target=self._connect, args=(self._connect_attempt, port, self.compression_var.get()), daemon=True).start()
+
+	def _connect(self, attempt: int, port: str, compression: bool):
+		try:
+			client = DeviceClient(port=port, compression=compression)
+		except Exception as exc:
+			self.bridge.post(self._connect_failed, attempt, port, exc)
+			return
+		self.bridge.post(self._connected, attempt, client)
+
+	def _connected(self, attempt: int, client: DeviceClient):
+		if attempt != self._connect_attempt:
+			client.close()
+			return
+		self.client = client
 		self.client.add_listener(self._on_device_event)
 		self.client.add_history_listeners(self._on_history_event)
+		self._append_chat_message(f"Connected (firmware {client.version or 'unknown'})", False, True)
+
+	def _connect_failed(self, attempt: int, port: str, error: Exception):
+		if attempt == self._connect_attempt:
+			self._append_chat_message(f"Could not open {port}: {error}", False, True)
 
 	def _append_chat_message(self, message: str, is_self: bool, system_message: bool = False):
 		label = "sent" if is_self else "received"
 		if system_message:
 			label = "system"
-		line = f"[{label}] {message}\n"
-		self.chat_text.configure(state="normal")
-		self.chat_text.insert("end", line, label)
-		self.chat_text.see("end")
-		self.chat_text.configure(state="disabled")
+		self.chat_view.append(f"[{label}] {message}", label)
 
 	def _send_chat_message(self, event=None):
 		message = self.chat_entry.get().strip()
@@ -161,26 +203,48 @@ class ChatUI(tk.Tk):
 		self._append_chat_message(message, True)
 		self.chat_entry.delete(0, "end")
 
-		threading.Thread(
-			target=self._send_chat_message_async,
-			args=(message, destination),
-			daemon=True,
-		).start()
+		# send_text only queues the frame for the client's writer thread; never wait here for room.
+		try:
+			if message.isascii():
+				self.client.send_text(message, destination, block=False)
+			else:
+				self.client.send_bytes(message.encode("utf-8"), destination, block=False)
+		except Full:
+			self._append_chat_message("Send queue is full, message not sent", False, True)
+			return
+		stats = self.client.compression_stats
+		if stats is not None:
+			self.compression_stats_var.set(f"Saved {stats.saved_bytes} of {stats.original_bytes} bytes ({stats.compressed}/{stats.messages} messages compressed)")
 
-	def _send_chat_message_async(self, message: str, destination: str):
-		self.client.send_text(message, destination)
+	def _handle_close(self):
+		self._connect_attempt += 1
+		if self.client:
+			self.client.close()
+		self._chat_archive.close()
+		self.bridge.close()
+		self.destroy()
 
 	def _handle_reset(self):
-		self.client.reset()
+		self.client.reset().add_done_callback(self._on_command_done)
 
 	def _handle_show_version(self):
-		self.client.request_version()
+		self.client.request_version().add_done_callback(self._on_command_done)
 
 	def _handle_get_address(self):
-		self.client.request_address()
+		self.client.request_address().add_done_callback(self._on_command_done)
 
 	def _handle_apply_device_address(self):
-		self.client.set_device_address(self.device_address_var.get())
+		self.client.set_device_address(self.device_address_var.get()).add_done_callback(self._on_command_done)
+
+	def _on_command_done(self, future):
+		# The answer itself is shown by _on_device_event; only report commands that failed.
+		if future.cancelled():
+			return
+		error = future.exception()
+		if isinstance(error, TimeoutError):
+			self._append_chat_message(str(error).capitalize(), False, True)
+		elif error is not None:
+			self._append_chat_message(f"Command failed: {error}", False, True)
 
 	def _handle_configure(self):
 		g_raw = self.config_group_var.get().strip()
@@ -194,98 +258,55 @@ class ChatUI(tk.Tk):
 			self._append_chat_message("Configure values must be integers", False, True)
 			return
 
-		self.client.configure(group, parameter, value)
+		self.client.configure(group, parameter, value).add_done_callback(self._on_command_done)
 
 		self.config_group_var.set("")
 		self.config_param_var.set("")
 		self.config_value_var.set("")
 
-	def _on_device_event(self, message: str):
-		self.after(0, self._deliver_device_event, message)
-
-	def _on_history_event(self, direction: str, payload: str):
-		self.after(0, self._deliver_history_event, direction, payload)
-
-	def _deliver_device_event(self, raw: str):
-		system_message, message = self._extract_incoming_message(raw)
+	# Both run on the client's threads; the views hand the lines to the Tk thread through the bridge.
+	def _on_device_event(self, event: DeviceEvent):
+		system_message, message = self._extract_incoming_message(event)
 		if message is not None:
 			self._append_chat_message(message, False, system_message)
 
-	def _deliver_history_event(self, direction: str, payload: str):
+	def _on_history_event(self, direction: str, payload: str):
 		timestamp = datetime.now().strftime("%H:%M:%S")
-		line = f"[{timestamp}] [{direction}]: {payload}\n"
-		self.history_text.configure(state="normal")
-		self.history_text.insert("end", line)
-		self.history_text.see("end")
-		self.history_text.configure(state="disabled")		
-
-	def _extract_incoming_message(self, raw: str) -> Optional[Tuple[bool, str]]:
-		if not raw.startswith("m["):
-			if raw == "r":
-				# Reset acknowledgment
-				return True, "Device has been reset"
-			if raw.startswith("p["):
-				# Version response
-				return True, f"You use version {raw[2:-1]}"
-			if raw.startswith("a["):
-				# Version response
-				return True, f"Your address is {raw[2:-1]}"
-			if raw.startswith("c["):
-				# Version or address response
-				return True, self._get_configuration_string(raw[2:-1])
-			return None, None
-		body = raw[2:-1] if raw.endswith("]") else raw[2:]
-		parts = body.split(",", 2)
-		if len(parts) < 3:
-			#ACK
-			if parts[0] == "R" and parts[1] == "A":
-				return True, "Sending was successful (ACK received)"
-			return None, None
-		if parts[0] != "R" or parts[1] != "D":
-			return None, None
-		payload = parts[2]
-		if not payload:
-			return None, None
-		#normal message
-		return False, payload
+		self.history_view.append(f"[{timestamp}] [{direction}]: {payload}")
+
+	def _extract_incoming_message(self, event: DeviceEvent) -> Optional[Tuple[bool, str]]:
+		if isinstance(event, Reset):
+			# Reset acknowledgment
+			return True, "Device has been reset"
+		if isinstance(event, Version):
+			return True, f"You use version {event.version}"
+		if isinstance(event, Address):
+			return True, f"Your address is {event.address}"
+		if isinstance(event, Config):
+			return True, self._get_configuration_string(event)
+		if isinstance(event, Ack):
+			return True, "Sending was successful (ACK received)"
+		if isinstance(event, Data) and event.payload:
+			data = decode_payload(event.payload)
+			if data is not None:
+				# binary-safe message, e.g. non-ASCII text
+				return False, data.decode("utf-8", errors="replace")
+			#normal message
+			return False, event.payload
+		return None, None
 	
-	def _get_configuration_string(self, raw: str) -> str:
-		parameters = [
-			[
-				"PHY preamble length",
-				"FEC threshold (default: disabled)",
-				"Channel busy threshold (default: 20)",
-				"light emission (enable/disable)",
-			],
-			[
-				"# of re-transmissions",
-				"DIFS",
-				"CWmin (use power of two)",
-				"CWmax (use power of two)",
-				"RTS threshold (default: disabled)",
-				"MAC address",
-			],
-			[
-				"logging level (0: none, 7: silly)",
-				"logger prefix character (default: disabled)",
-			],
-		]
-		groups = ["PHY", "MAC", "LOG"]
-
-		parts = [p.strip() for p in raw.split(",")]
-		try:
-			g = int(parts[0], 0)
-			p = int(parts[1], 0)
-			v = int(parts[2], 0)
-		except ValueError:
+	def _get_configuration_string(self, event: Config) -> str:
+		if event.group is None:
 			return "Unexpected error parsing configuration response"
+		g, p, v = event.group, event.parameter, event.value
 
-		if g < 0 or g >= len(parameters):
-			return f"There are 3 groups (0-2): {g} leads to undefined behaviour"
-		if p < 0 or p >= len(parameters[g]):
-			return f"There are {len(parameters[g])} parameters (0-{len(parameters[g]) - 1}) in group {groups[g]}: {p} leads to undefined behaviour"
+		if g < 0 or g >= len(PARAMETER_TABLE):
+			return f"There are {len(GROUPS)} groups (0-{len(GROUPS) - 1}): {g} leads to undefined behaviour"
+		parameters = PARAMETER_TABLE[g]
+		if p < 0 or p >= len(parameters):
+			return f"There are {len(parameters)} parameters (0-{len(parameters) - 1}) in group {GROUPS[g]}: {p} leads to undefined behaviour"
 
-		return f"You set {parameters[g][p]} to be {v}"
+		return f"You set {parameters[p][1]} to be {v}"
 
 app = ChatUI()
 app.mainloop()
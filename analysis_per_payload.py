@@ -1,15 +1,80 @@
 import os
+import warnings
 import matplotlib.pyplot as plt
-from math import isclose, sqrt, floor
 import numpy as np
 
+import capture
+from stats import confidence_interval, summarize
+
 output_folder = "../wireless-assignment5/output"
 
 data_per_payload = {}
 
+LEGACY_TIMEOUT = "10"
+TIMEOUT_MS = 10000.0
+
+cache_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".analysis_cache")
+
+capture_dtype = np.dtype([
+    ("timestamp_ns", "<i8"),
+    ("direction", "u1"),
+    ("command", "u1"),
+    ("frame_id", "<u4"),
+    ("payload_length", "<u4"),
+    ("rtt_ms", "<f8"),
+])
+assert capture_dtype.itemsize == capture.RECORD.size
+
+def parse_result_file(file_path):
+    if file_path.endswith(".vlcc"):
+        with open(file_path, "rb") as handle:
+            header = handle.read(capture.HEADER.size)
+        if len(header) < capture.HEADER.size:
+            raise ValueError(f"{file_path} is not a capture file")
+        magic, version, record_size = capture.HEADER.unpack(header)
+        if magic != capture.MAGIC or version not in capture.READABLE_VERSIONS or record_size != capture.RECORD.size:
+            raise ValueError(f"{file_path} is not a capture file this version can read")
+        # A writer that was killed can leave a partial record at the end; it is ignored.
+        count = (os.path.getsize(file_path) - capture.HEADER.size) // capture.RECORD.size
+        if not count:
+            return np.empty(0, dtype=np.float64)
+        records = np.memmap(file_path, dtype=capture_dtype, mode="r", offset=capture.HEADER.size, shape=(count,))
+        results = records[(records["direction"] == capture.RESULT) & (records["command"] != capture.RESULT_LATE)]
+        return np.array(results["rtt_ms"], dtype=np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        tokens = np.loadtxt(file_path, dtype=str, ndmin=1)
+    data = tokens.astype(np.float64)
+    # Timeouts are logged in milliseconds like the RTTs. Older result files logged the
+    # 10 s timeout as the bare token "10"; RTTs are always written with decimals.
+    data[tokens == LEGACY_TIMEOUT] = TIMEOUT_MS
+    return data
+
+def load_result_file(file_path):
+    stat = os.stat(file_path)
+    name = os.path.basename(file_path)
+    cache_path = os.path.join(cache_folder, f"{name}.{stat.st_mtime_ns}.{stat.st_size}.npy")
+    if os.path.isfile(cache_path):
+        return np.load(cache_path)
+    data = parse_result_file(file_path)
+    try:
+        os.makedirs(cache_folder, exist_ok=True)
+        for stale in os.listdir(cache_folder):
+            if stale.startswith(name + ".") and stale.endswith(".npy"):
+                os.remove(os.path.join(cache_folder, stale))
+        np.save(cache_path, data)
+    except OSError:
+        pass
+    return data
+
 def load_data():
     for filename in os.listdir(output_folder):
         file_path = os.path.join(output_folder, filename)
+        # .late lists and the .summary.json / sweep_summary.json files are not RTT results.
+        if not os.path.isfile(file_path) or filename.endswith((".late", ".json")):
+            continue
+        if filename.endswith(".vlcc") and os.path.isfile(file_path[:-len(".vlcc")]):
+            continue
 
         short_name = filename[len("payload"):]
         lowdash_index = short_name.index("_")
@@ -19,17 +84,7 @@ def load_data():
 
         distance = short_name[lowdash_index + 1:short_name.index("cm")]
 
-        data = []
-        if os.path.isfile(file_path):
-            with open(file_path, "r") as f:
-                for line in f:
-                    data.append(float(line.strip()))
-        def change_timeout(el):
-            if isclose(el, 10.0):
-                return 10000.0
-            return el    
-        data = list(map(change_timeout, data))
-        data_per_payload[payload_size][distance] = data
+        data_per_payload[payload_size][distance] = load_result_file(file_path)
 
 def generate_plots():
     for payload_size in data_per_payload:
@@ -59,21 +114,11 @@ def generate_plots():
         plt.legend()
         plt.show()
 
-def mean(values):
-    return sum(values) / len(values)
-
-def stddev(values, m):
-    return sqrt(sum((x - m) ** 2 for x in values) / (len(values) - 1))
-
-def confidence_interval(values):
-    m = mean(values)
-    s = stddev(values, m)
-    n = len(values)
-
-    z = 1.96  
-    margin = z * (s / sqrt(n))
-
-    return (m - margin, m + margin)
+def print_summary(payload_size, distances, min_length, digits):
+    summary = summarize([data_per_payload[payload_size][dist][:min_length] for dist in distances])
+    for dist, m, s in zip(distances, summary["mean"], summary["stddev"]):
+        print("mean (d:", dist, "): ", round(float(m), digits))
+        print("stddev: ", round(float(s), digits))
 
 load_data()
 
@@ -89,18 +134,6 @@ measurements = [
     [data_per_payload["1"]["55"], data_per_payload["100"]["55"], data_per_payload["180"]["55"]],
 ]
 
-def closest_interval_to_mean(values, fraction):
-    """Return (mean, lo, hi) where lo..hi is interval covering fraction of values
-       that are closest (by absolute deviation) to the mean."""
-    m = mean(values)
-    def sort_by_dist_to_mean(a):
-        return abs(a - m)
-    sorted_vals = sorted(values, key=sort_by_dist_to_mean)
-    k = max(1, int(floor(fraction * len(values))))
-    vals_to_take = sorted_vals[:k]
-    lo, hi = min(vals_to_take), max(vals_to_take)
-    return (m, lo, hi)
-
 n_dist = len(distances)
 n_groups = 3
 
@@ -109,19 +142,16 @@ x = np.arange(n_dist)
 width = 0.15
 offsets = np.linspace(-width, width, n_groups)
 
+summary = summarize([measurements[i][g] for g in range(n_groups) for i in range(n_dist)], fractions=(0.5, 0.9))
+all_means = summary["mean"].reshape(n_groups, n_dist)
+all_low50, all_high50 = (bound.reshape(n_groups, n_dist) for bound in summary["intervals"][0.5])
+all_low80, all_high80 = (bound.reshape(n_groups, n_dist) for bound in summary["intervals"][0.9])
+
 fig, ax = plt.subplots(figsize=(10,6))
 for g in range(n_groups):
-    means = []
-    low50 = []; high50 = []
-    low80 = []; high80 = []
-
-    for i in range(n_dist):
-        mu, lo50, hi50 = closest_interval_to_mean(measurements[i][g], 0.5)
-        _,  lo80, hi80 = closest_interval_to_mean(measurements[i][g], 0.9)
-
-        means.append(mu)
-        low50.append(lo50); high50.append(hi50)
-        low80.append(lo80); high80.append(hi80)
+    means = all_means[g]
+    low50, high50 = all_low50[g], all_high50[g]
+    low80, high80 = all_low80[g], all_high80[g]
 
     xs = x + offsets[g]
 
@@ -146,33 +176,26 @@ plt.show()
 
 print("Confidence Interval for payload size 1 and distance <= 40 cm:")
 min_length = min(map(len, data_per_payload["1"].values()))
-data = data_per_payload["1"]["2_5"][:min_length] \
-    + data_per_payload["1"]["10"][:min_length] \
-    + data_per_payload["1"]["20"][:min_length] \
-    + data_per_payload["1"]["30"][:min_length] \
-    + data_per_payload["1"]["40"][:min_length]
+data = np.concatenate([
+    data_per_payload["1"]["2_5"][:min_length],
+    data_per_payload["1"]["10"][:min_length],
+    data_per_payload["1"]["20"][:min_length],
+    data_per_payload["1"]["30"][:min_length],
+    data_per_payload["1"]["40"][:min_length],
+])
 print(confidence_interval(data))
 
 distances = ["2_5", "10", "20", "30", "40", "50", "55"]
 print("Standard deviations for payload size 1 and each of the distances:")
-for dist in distances:
-    m = mean(data_per_payload["1"][dist][:min_length])
-    print("mean (d:", dist, "): ", round(m, 3))
-    print("stddev: ", round(stddev(data_per_payload["1"][dist][:min_length], m), 3))
+print_summary("1", distances, min_length, 3)
 
 print("Standard deviations for payload size 100 and each of the distances:")
 min_length = min(map(len, data_per_payload["100"].values()))
-for dist in distances:
-    m = mean(data_per_payload["100"][dist][:min_length])
-    print("mean (d:", dist, "): ", round(m, 3))
-    print("stddev: ", round(stddev(data_per_payload["100"][dist][:min_length], m), 3))
+print_summary("100", distances, min_length, 3)
 
 print("Standard deviations for payload size 180 and each of the distances:")
 min_length = min(map(len, data_per_payload["180"].values()))
-for dist in distances:
-    m = mean(data_per_payload["180"][dist][:min_length])
-    print("mean (d:", dist, "): ", round(m, 3))
-    print("stddev: ", round(stddev(data_per_payload["180"][dist][:min_length], m), 3))
+print_summary("180", distances, min_length, 3)
 
 # for delay
 generate_plots()
@@ -180,31 +203,19 @@ generate_plots()
 for payload_size in data_per_payload:
     payload = int(payload_size)
     for dist in data_per_payload[payload_size]:
-        new_arr = []
-        for val in data_per_payload[payload_size][dist]:
-            new_arr.append(payload / (val + 0.01))
-        data_per_payload[payload_size][dist] = new_arr
+        data_per_payload[payload_size][dist] = payload / (data_per_payload[payload_size][dist] + 0.01)
 
 # for throughput
 generate_plots()
 
 distances = ["2_5", "10", "20", "30", "40", "50", "55"]
 print("Standard deviations for payload size 1 and each of the distances: (THROUGHPUT)")
-for dist in distances:
-    m = mean(data_per_payload["1"][dist][:min_length])
-    print("mean (d:", dist, "): ", round(m, 5))
-    print("stddev: ", round(stddev(data_per_payload["1"][dist][:min_length], m), 5))
+print_summary("1", distances, min_length, 5)
 
 print("Standard deviations for payload size 100 and each of the distances: (THROUGHPUT)")
 min_length = min(map(len, data_per_payload["100"].values()))
-for dist in distances:
-    m = mean(data_per_payload["100"][dist][:min_length])
-    print("mean (d:", dist, "): ", round(m, 5))
-    print("stddev: ", round(stddev(data_per_payload["100"][dist][:min_length], m), 5))
+print_summary("100", distances, min_length, 5)
 
 print("Standard deviations for payload size 180 and each of the distances: (THROUGHPUT)")
 min_length = min(map(len, data_per_payload["180"].values()))
-for dist in distances:
-    m = mean(data_per_payload["180"][dist][:min_length])
-    print("mean (d:", dist, "): ", round(m, 5))
-    print("stddev: ", round(stddev(data_per_payload["180"][dist][:min_length], m), 5))
+print_summary("180", distances, min_length, 5)
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncIterator, Callable, Iterable, List, Optional, Tuple
+
+import serial
+
+import payload_codec
+import protocol
+from device_client import DeviceClient
+from log_sink import LogSink, open_shared, release_shared
+from protocol import Address, Config, DeviceEvent, EventDispatcher, FrameParser, Reset, ResponseTracker, Version
+
+
+class _DeviceProtocol(asyncio.Protocol):
+
+	def __init__(self, client: "AsyncDeviceClient"):
+		self._client = client
+		self._parser = FrameParser()
+
+	def data_received(self, data: bytes):
+		for event in self._parser.feed(data):
+			self._client._on_event(event)
+
+	def connection_lost(self, exc: Optional[Exception]):
+		self._client._on_connection_lost()
+
+
+class _WriterProtocol(asyncio.BaseProtocol):
+
+	def __init__(self):
+		self._can_write = asyncio.Event()
+		self._can_write.set()
+
+	def pause_writing(self):
+		self._can_write.clear()
+
+	def resume_writing(self):
+		self._can_write.set()
+
+	async def drain(self):
+		await self._can_write.wait()
+
+
+class AsyncDeviceClient:
+	"""asyncio counterpart of DeviceClient.
+
+	The serial port is driven by read and write pipe transports on its file
+	descriptor, so any number of boards can share one event loop without a
+	reader thread each. Create instances with `await AsyncDeviceClient.open(port)`.
+	"""
+
+	STARTUP_TIMEOUT = DeviceClient.STARTUP_TIMEOUT
+	PROBE_INTERVAL = DeviceClient.PROBE_INTERVAL
+	MAX_PROBE_INTERVAL = DeviceClient.MAX_PROBE_INTERVAL
+	COMMAND_TIMEOUT = DeviceClient.COMMAND_TIMEOUT
+
+	def __init__(self, port: Optional[str] = None, baudrate: int = 115200, log_sink: Optional[LogSink] = None, compression: bool = False):
+		self.port = port
+		self.baudrate = baudrate
+		self.compression_stats: Optional[payload_codec.CompressionStats] = payload_codec.CompressionStats() if compression else None
+
+		self._listeners = EventDispatcher()
+		self._history_listeners: List[Callable[[str, str]]] = []
+		self._owns_log_sink = log_sink is None
+		self._log_sink = log_sink if log_sink is not None else open_shared()
+
+		self._serial: Optional[serial.Serial] = None
+		self._read_transport: Optional[asyncio.ReadTransport] = None
+		self._write_transport: Optional[asyncio.WriteTransport] = None
+		self._writer: Optional[_WriterProtocol] = None
+		# One queue per running events() iterator: each iterator sees every event,
+		# and a client used through commands and listeners does not keep any.
+		self._event_queues: List["asyncio.Queue[Optional[DeviceEvent]]"] = []
+		self._closed = False
+		self.version: Optional[str] = None
+		self._ready = asyncio.Event()
+		self._listeners.add(self._on_version, (Version,))
+		self._responses = ResponseTracker()
+		self._listeners.add(self._responses.resolve, ResponseTracker.RESPONSE_TYPES)
+
+	@classmethod
+	async def open(cls, port: Optional[str] = None, baudrate: int = 115200, log_sink: Optional[LogSink] = None, compression: bool = False) -> "AsyncDeviceClient":
+		client = cls(port, baudrate, log_sink, compression)
+		await client._connect()
+		return client
+
+	async def _connect(self):
+		loop = asyncio.get_running_loop()
+		self._serial = serial.Serial(self.port, self.baudrate, timeout=0)
+		self._read_transport, _ = await loop.connect_read_pipe(lambda: _DeviceProtocol(self), self._serial)
+		self._write_transport, self._writer = await loop.connect_write_pipe(_WriterProtocol, self._serial)
+		await self.wait_until_ready()
+
+	async def wait_until_ready(self, timeout: float = STARTUP_TIMEOUT) -> bool:
+		"""Probe with version requests, backing off, until the board answers; see DeviceClient."""
+		loop = asyncio.get_running_loop()
+		deadline = loop.time() + timeout
+		interval = self.PROBE_INTERVAL
+		while not self._ready.is_set():
+			remaining = deadline - loop.time()
+			if remaining <= 0:
+				return False
+			await self._write_command(protocol.REQUEST_VERSION)
+			try:
+				await asyncio.wait_for(self._ready.wait(), min(interval, remaining))
+			except asyncio.TimeoutError:
+				interval = min(interval * 2, self.MAX_PROBE_INTERVAL)
+		return True
+
+	@property
+	def ready(self) -> bool:
+		return self._ready.is_set()
+
+	def _on_version(self, event: Version):
+		self.version = event.version
+		self._ready.set()
+
+	async def close(self):
+		if self._closed:
+			return
+		self._closed = True
+		if self._write_transport:
+			self._write_transport.close()
+		if self._read_transport:
+			self._read_transport.close()
+		if self._serial and self._serial.is_open:
+			self._serial.close()
+		if self._owns_log_sink:
+			release_shared(self._log_sink)
+			self._owns_log_sink = False
+		self._responses.fail_all(ConnectionError("device client closed"))
+		self._end_events()
+
+	async def __aenter__(self) -> "AsyncDeviceClient":
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.close()
+
+	def add_listener(self, callback: Callable[[DeviceEvent]], *event_types: type):
+		self._listeners.add(callback, event_types)
+
+	def remove_listener(self, callback: Callable[[DeviceEvent]]):
+		self._listeners.remove(callback)
+
+	def add_history_listeners(self, callback: Callable[[str, str]]):
+		self._history_listeners.append(callback)
+
+	async def events(self) -> AsyncIterator[DeviceEvent]:
+		if self._closed:
+			return
+		queue: "asyncio.Queue[Optional[DeviceEvent]]" = asyncio.Queue()
+		self._event_queues.append(queue)
+		try:
+			while True:
+				message = await queue.get()
+				if message is None:
+					return
+				yield message
+		finally:
+			self._event_queues.remove(queue)
+
+	def __aiter__(self) -> AsyncIterator[DeviceEvent]:
+		return self.events()
+
+	# Control commands return the device's answer, like the futures of
+	# DeviceClient; they raise TimeoutError if it does not come in time.
+	async def reset(self, timeout: Optional[float] = COMMAND_TIMEOUT) -> Reset:
+		return await self._request(protocol.RESET, protocol.RESET_KEY, timeout)
+
+	async def request_version(self, timeout: Optional[float] = COMMAND_TIMEOUT) -> Version:
+		return await self._request(protocol.REQUEST_VERSION, protocol.VERSION_KEY, timeout)
+
+	async def request_address(self, timeout: Optional[float] = COMMAND_TIMEOUT) -> Address:
+		return await self._request(protocol.REQUEST_ADDRESS, protocol.ADDRESS_KEY, timeout)
+
+	async def set_device_address(self, address: str, timeout: Optional[float] = COMMAND_TIMEOUT) -> Address:
+		return await self._request(protocol.encode_set_address(address), protocol.ADDRESS_KEY, timeout)
+
+	async def send_text(self, message: str, destination: str):
+		if self.compression_stats is not None:
+			payload = payload_codec.compress_payload(message)
+			self.compression_stats.record(len(message), len(payload))
+			message = payload
+		await self._write_command(protocol.encode_text(message, destination))
+
+	async def send_bytes(self, data: bytes, destination: str):
+		await self.send_text(payload_codec.encode_payload(data), destination)
+
+	async def configure(self, group: int, parameter: int, value: int, timeout: Optional[float] = COMMAND_TIMEOUT) -> Config:
+		return await self._request(protocol.encode_config(group, parameter, value), protocol.config_key(group, parameter), timeout)
+
+	async def configure_many(self, settings: Iterable[Tuple[int, int, int]], timeout: Optional[float] = COMMAND_TIMEOUT) -> List[Config]:
+		"""Write every setting before waiting for the first answer; see DeviceClient.configure_many."""
+		requests = []
+		for group, parameter, value in settings:
+			key = protocol.config_key(group, parameter)
+			requests.append((await self._send_request(protocol.encode_config(group, parameter, value), key), key))
+		return list(await asyncio.gather(*(self._wait_for_response(future, key, timeout) for future, key in requests)))
+
+	async def _request(self, command: str, key: tuple, timeout: Optional[float]):
+		return await self._wait_for_response(await self._send_request(command, key), key, timeout)
+
+	async def _send_request(self, command: str, key: tuple) -> asyncio.Future:
+		future = asyncio.get_running_loop().create_future()
+		self._responses.expect(key, future)
+		await self._write_command(command)
+		return future
+
+	async def _wait_for_response(self, future: asyncio.Future, key: tuple, timeout: Optional[float]):
+		try:
+			return await asyncio.wait_for(future, timeout)
+		except asyncio.TimeoutError:
+			raise TimeoutError(f"no response to {key[0]} command within {timeout:g} s") from None
+
+	async def _write_command(self, command: str):
+		if self._closed or self._write_transport is None:
+			raise ConnectionError("device is not connected")
+		self._write_transport.write(f"{command}\n".encode("ascii", errors="replace"))
+		await self._writer.drain()
+		self._append_to_log_and_history("to device", command)
+
+	def _on_event(self, event: DeviceEvent):
+		self._append_to_log_and_history("from device", event.raw)
+		self._listeners.emit(event)
+		for queue in self._event_queues:
+			queue.put_nowait(event)
+
+	def _on_connection_lost(self):
+		if not self._closed:
+			self._closed = True
+			self._responses.fail_all(ConnectionError("device connection lost"))
+			self._end_events()
+
+	def _end_events(self):
+		for queue in self._event_queues:
+			queue.put_nowait(None)
+
+	def _append_to_log_and_history(self, direction: str, payload: str):
+		self._log_sink.log(direction, payload)
+
+		for callback in self._history_listeners:
+			callback(direction, payload)
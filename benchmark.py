@@ -0,0 +1,217 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from collections import deque
+from pathlib import Path
+from threading import Event
+from time import perf_counter_ns, process_time, time
+
+from device_client import DeviceClient
+from instrumentation import Instrumentation
+from log_sink import LogSink
+from online_stats import LogHistogram
+from protocol import Ack, Data, EventDispatcher, FrameParser
+from simulated_device import LoopbackSerial, SimulatedDevice
+
+RESULTS_PATH = Path("output") / "benchmark_results.jsonl"
+
+
+class _TimedLoopback(LoopbackSerial):
+    """Loopback transport that timestamps every line the device hands over."""
+
+    def __init__(self, device: SimulatedDevice):
+        super().__init__(device)
+        self.arrivals = deque()
+
+    def _receive(self, data: bytes):
+        self.arrivals.append(perf_counter_ns())
+        super()._receive(data)
+
+
+def run_case(payload_size: int, listeners: int, frames: int, log_dir: Path, instrument: bool = False) -> dict:
+    """Push frames through DeviceClient against a zero-latency simulated device.
+
+    A burst of `frames` sends measures throughput and CPU per frame; a
+    ping-pong phase then sends one frame at a time to time each stage
+    without queueing delay.
+    """
+    device = SimulatedDevice()
+    transport = _TimedLoopback(device)
+    sink = LogSink(log_dir / f"bench_{payload_size}_{listeners}.txt")
+    instrumentation = Instrumentation() if instrument else None
+    client = DeviceClient(transport=transport, log_sink=sink, instrumentation=instrumentation)
+
+    send_hist = LogHistogram()
+    receive_hist = LogHistogram()
+    round_trip_hist = LogHistogram()
+    acked = Event()
+    state = {"acked": 0, "target": frames, "received_ns": 0}
+
+    def on_ack(message: str):
+        state["received_ns"] = perf_counter_ns()
+        state["arrival_ns"] = transport.arrivals.popleft()
+        state["acked"] += 1
+        if state["acked"] >= state["target"]:
+            acked.set()
+
+    for _ in range(listeners - 1):
+        client.add_listener(lambda message: None)
+    client.add_listener(on_ack, Ack)
+
+    message = "A" * payload_size
+    cpu_start = process_time()
+    wall_start = perf_counter_ns()
+    for _ in range(frames):
+        client.send_text(message, "FF")
+    acked.wait(60)
+    wall_ns = perf_counter_ns() - wall_start
+    cpu_s = process_time() - cpu_start
+    burst_acked = state["acked"]
+
+    for _ in range(min(frames, 1000)):
+        acked.clear()
+        state["target"] = state["acked"] + 1
+        start = perf_counter_ns()
+        client.send_text(message, "FF")
+        sent = perf_counter_ns()
+        if not acked.wait(1):
+            break
+        send_hist.add((sent - start) / 1000)
+        receive_hist.add((state["received_ns"] - state["arrival_ns"]) / 1000)
+        round_trip_hist.add((state["received_ns"] - start) / 1000)
+
+    client.close()
+    sink.close()
+    device.close()
+
+    case = {
+        "payload_size": payload_size,
+        "listeners": listeners,
+        "frames": frames,
+        "acked": burst_acked,
+        "frames_per_s": burst_acked / (wall_ns / 1e9),
+        "cpu_us_per_frame": cpu_s * 1e6 / max(burst_acked, 1),
+        "send_us": send_hist.percentiles((50, 99)),
+        "receive_us": receive_hist.percentiles((50, 99)),
+        "round_trip_us": round_trip_hist.percentiles((50, 99)),
+    }
+    if instrumentation is not None:
+        case["stages"] = instrumentation.snapshot()
+    return case
+
+
+def _legacy_consumers(line: bytes):
+    """The string handling used before protocol.py: decode per line, then every consumer re-parses."""
+    text = line.decode("ascii", errors="replace").strip()
+    if not text:
+        return
+    for consumer in range(2):
+        if not text.startswith("m["):
+            continue
+        body = text[2:-1] if text.endswith("]") else text[2:]
+        parts = body.split(",", 2)
+        if consumer == 0 and len(parts) >= 2 and parts[0] == "R" and parts[1] == "A":
+            pass
+        elif consumer == 1 and len(parts) == 3 and parts[0] == "R" and parts[1] == "D":
+            pass
+
+
+def run_codec_case(lines: int, chunk_size: int = 256) -> dict:
+    """Time decoding device output with the typed codec against the old string path.
+
+    The stream mixes ACKs and received data the way a chat session does;
+    both paths feed an ACK consumer and a data consumer.
+    """
+    stream = b"".join(b"m[R,A]\n" if index % 2 else b"m[R,D,%s]\n" % (b"B" * 50) for index in range(lines))
+    chunks = [stream[start:start + chunk_size] for start in range(0, len(stream), chunk_size)]
+
+    start = perf_counter_ns()
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        *complete, buffer = buffer.split(b"\n")
+        for line in complete:
+            _legacy_consumers(line)
+    legacy_ns = perf_counter_ns() - start
+
+    parser = FrameParser()
+    dispatcher = EventDispatcher()
+    dispatcher.add(lambda event: None, (Ack,))
+    dispatcher.add(lambda event: None, (Data,))
+    start = perf_counter_ns()
+    for chunk in chunks:
+        for event in parser.feed(chunk):
+            dispatcher.emit(event)
+    codec_ns = perf_counter_ns() - start
+
+    return {"lines": lines, "legacy_ns_per_line": legacy_ns / lines, "codec_ns_per_line": codec_ns / lines}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        return ""
+
+
+def load_previous(path: Path) -> dict:
+    previous = {}
+    if path.is_file():
+        for line in path.read_text().splitlines():
+            if line.strip():
+                result = json.loads(line)
+                previous[(result["case"]["payload_size"], result["case"]["listeners"])] = result
+    return previous
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the per-frame cost of the host-side DeviceClient stack.")
+    parser.add_argument("--frames", type=int, default=5000)
+    parser.add_argument("--payload-sizes", type=int, nargs="+", default=[1, 100, 180])
+    parser.add_argument("--listeners", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--results", type=Path, default=RESULTS_PATH, help="JSON lines file the results are appended to")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--instrument", action="store_true", help="also record DeviceClient's per-stage timings")
+    parser.add_argument("--codec", action="store_true", help="only compare protocol decoding against the old string handling")
+    args = parser.parse_args(argv)
+
+    if args.codec:
+        result = run_codec_case(max(args.frames, 100_000))
+        print(f"{result['lines']} lines: string handling {result['legacy_ns_per_line']:.0f} ns/line, protocol codec {result['codec_ns_per_line']:.0f} ns/line")
+        return 0
+
+    previous = load_previous(args.results)
+    revision = git_revision()
+    records = []
+    print(f"{'payload':>8} {'listeners':>9} {'frames/s':>10} {'cpu us/f':>9} {'send p50/p99 us':>16} {'recv p50/p99 us':>16} {'rtt p50/p99 us':>16}  vs previous")
+    with tempfile.TemporaryDirectory() as log_dir:
+        for payload_size in args.payload_sizes:
+            for listeners in args.listeners:
+                case = run_case(payload_size, listeners, args.frames, Path(log_dir), args.instrument)
+                before = previous.get((payload_size, listeners))
+                change = ""
+                if before:
+                    ratio = case["frames_per_s"] / before["case"]["frames_per_s"] - 1
+                    change = f"{ratio:+.1%} ({before['revision'] or 'unknown'})"
+                print(
+                    f"{payload_size:>8} {listeners:>9} {case['frames_per_s']:>10.0f} {case['cpu_us_per_frame']:>9.1f}"
+                    f" {case['send_us'][50]:>7.1f}/{case['send_us'][99]:<8.1f} {case['receive_us'][50]:>7.1f}/{case['receive_us'][99]:<8.1f}"
+                    f" {case['round_trip_us'][50]:>7.1f}/{case['round_trip_us'][99]:<8.1f}  {change}"
+                )
+                for stage, timing in case.get("stages", {}).items():
+                    print(f"{'':>19} {stage:>10}: p50 {timing['p50_us']:.1f} us, p99 {timing['p99_us']:.1f} us")
+                records.append({"timestamp": time(), "revision": revision, "python": platform.python_version(), "case": case})
+
+    if not args.no_save:
+        args.results.parent.mkdir(parents=True, exist_ok=True)
+        with args.results.open("a") as handle:
+            for record in records:
+                handle.write(json.dumps(record) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import mmap
+import struct
+from pathlib import Path
+from threading import Lock
+from time import time_ns
+from typing import Iterator, List, NamedTuple, Optional, Union
+
+# File layout: a 16 byte header (magic, version, record size) followed by
+# fixed-width little-endian records, so a capture can be appended to
+# forever and indexed without parsing. Since version 2 records are stamped
+# with wall-clock time (ns since the epoch); version 1 used perf_counter_ns,
+# which has no fixed origin.
+MAGIC = b"VLCCAP\0\0"
+VERSION = 2
+READABLE_VERSIONS = (1, 2)
+HEADER = struct.Struct("<8sHH4x")
+RECORD = struct.Struct("<qBBIId")
+
+TO_DEVICE = 0
+FROM_DEVICE = 1
+RESULT = 2
+
+DIRECTIONS = {"to device": TO_DEVICE, "from device": FROM_DEVICE}
+
+# Command byte of RESULT records.
+RESULT_ACK = ord("A")
+RESULT_TIMEOUT = ord("T")
+RESULT_LATE = ord("L")
+
+NO_FRAME = 0xFFFFFFFF
+NO_RTT = float("nan")
+
+
+class CaptureRecord(NamedTuple):
+	timestamp_ns: int
+	direction: int
+	command: int
+	frame_id: int
+	payload_length: int
+	rtt_ms: float
+
+
+def payload_length(line: str) -> int:
+	"""Length of the message in an m[...] line, or of the whole line otherwise."""
+	if line.startswith("m[R,D,"):
+		return len(line) - len("m[R,D,]")
+	if line.startswith("m[R,"):
+		return 0
+	if line.startswith("m["):
+		end = line.find("\0")
+		return (end if end >= 0 else len(line) - 1) - 2
+	return len(line)
+
+
+class CaptureWriter:
+
+	def __init__(self, path: Union[str, Path]):
+		self.path = Path(path)
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		self._lock = Lock()
+		self._handle = self.path.open("a+b")
+		self._handle.seek(0)
+		header = self._handle.read(HEADER.size)
+		if not header:
+			self._handle.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+		elif len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, VERSION, RECORD.size):
+			self._handle.close()
+			raise ValueError(f"{self.path} is not a version {VERSION} capture file, not appending to it")
+
+	def write(self, direction: int, command: int, frame_id: int = NO_FRAME, length: int = 0, rtt_ms: float = NO_RTT, timestamp_ns: Optional[int] = None):
+		record = RECORD.pack(time_ns() if timestamp_ns is None else timestamp_ns, direction, command, frame_id, length, rtt_ms)
+		with self._lock:
+			if self._handle:
+				self._handle.write(record)
+
+	def write_line(self, direction: str, line: str):
+		command = ord(line[0]) if line and ord(line[0]) < 128 else 0
+		self.write(DIRECTIONS[direction], command, NO_FRAME, payload_length(line))
+
+	def write_result(self, kind: int, frame_id: int, rtt_ms: float, length: int = 0):
+		self.write(RESULT, kind, frame_id, length, rtt_ms)
+
+	def flush(self):
+		with self._lock:
+			if self._handle:
+				self._handle.flush()
+
+	def close(self):
+		with self._lock:
+			if self._handle:
+				self._handle.close()
+				self._handle = None
+
+
+class CaptureReader:
+	"""Random access to a capture file through mmap."""
+
+	def __init__(self, path: Union[str, Path]):
+		self.path = Path(path)
+		with self.path.open("rb") as handle:
+			header = handle.read(HEADER.size)
+			if len(header) < HEADER.size:
+				raise ValueError(f"{self.path} is not a capture file")
+			magic, self.version, record_size = HEADER.unpack(header)
+			if magic != MAGIC or self.version not in READABLE_VERSIONS or record_size != RECORD.size:
+				raise ValueError(f"{self.path} is not a capture file this version can read")
+			size = handle.seek(0, 2)
+			self._count = (size - HEADER.size) // RECORD.size
+			self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) if self._count else None
+
+	def __len__(self) -> int:
+		return self._count
+
+	def __getitem__(self, index: int) -> CaptureRecord:
+		if index < 0:
+			index += self._count
+		if not 0 <= index < self._count:
+			raise IndexError(index)
+		return CaptureRecord(*RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size))
+
+	def __iter__(self) -> Iterator[CaptureRecord]:
+		if not self._count:
+			return
+		view = memoryview(self._map)[HEADER.size:HEADER.size + self._count * RECORD.size]
+		try:
+			for fields in RECORD.iter_unpack(view):
+				yield CaptureRecord(*fields)
+		finally:
+			view.release()
+
+	def rtts(self) -> List[float]:
+		"""RTTs of acknowledged and timed-out frames, in send order of their results."""
+		return [record.rtt_ms for record in self if record.direction == RESULT and record.command != RESULT_LATE]
+
+	def close(self):
+		if self._map is not None:
+			self._map.close()
+			self._map = None
+
+	def __enter__(self) -> "CaptureReader":
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
@@ -1,98 +1,307 @@
 from __future__ import annotations
 
+from concurrent.futures import Future
+from heapq import heappop, heappush
+from itertools import count
 from pathlib import Path
-from threading import Event, Thread
-from time import sleep
-from typing import Callable, List, Optional
-from datetime import datetime
+from queue import Empty, PriorityQueue
+from threading import Condition, Event, Thread
+from time import monotonic, perf_counter_ns
+from typing import Callable, Iterable, List, Optional, Tuple
 
 import serial
 
+import payload_codec
+import protocol
+from capture import CaptureWriter
+from instrumentation import Instrumentation
+from log_sink import LogSink, open_shared, release_shared
+from protocol import Config, DeviceEvent, EventDispatcher, FrameParser, ResponseTracker, Version
+
+PRIORITY_CONTROL = 0
+PRIORITY_DATA = 1
+_PRIORITY_STOP = 2
+
 class DeviceClient:
 
-	STARTUP_DELAY = 2.0
+	# The board reboots when the port opens; it is ready once it answers a version request.
+	STARTUP_TIMEOUT = 5.0
+	COMMAND_TIMEOUT = 2.0
+	PROBE_INTERVAL = 0.05
+	MAX_PROBE_INTERVAL = 0.5
+	SEND_QUEUE_SIZE = 256
+	MAX_BATCH_BYTES = 4096
 
-	def __init__(self, port: Optional[str] = None, baudrate: int = 115200, timeout: float = 1.0):
+	def __init__(self, port: Optional[str] = None, baudrate: int = 115200, timeout: float = 1.0, log_sink: Optional[LogSink] = None, capture_path: Optional[Path] = None, transport=None, instrumentation: Optional[Instrumentation] = None, send_queue_size: int = SEND_QUEUE_SIZE, compression: bool = False, startup_timeout: float = STARTUP_TIMEOUT):
 
-		self._listeners: List[Callable[[str]]] = []
+		self._listeners = EventDispatcher()
 		self._history_listeners: List[Callable[[str, str]]] = []
 
 		self._stop_event = Event()
-		self._log_path = Path(__file__).with_name("log.txt")
-		
+		self._owns_log_sink = log_sink is None
+		self._log_sink = log_sink if log_sink is not None else open_shared()
+		self.capture: Optional[CaptureWriter] = CaptureWriter(capture_path) if capture_path else None
+		self.instrumentation = instrumentation
+		# With compression on, data frames are sent compressed whenever that makes them shorter.
+		self.compression_stats: Optional[payload_codec.CompressionStats] = payload_codec.CompressionStats() if compression else None
+		# Commands are written by one writer thread; control commands jump ahead of queued data.
+		self._send_queue: PriorityQueue = PriorityQueue(maxsize=send_queue_size)
+		self._send_sequence = count()
+		self.version: Optional[str] = None
+		self._ready = Event()
+		self._listeners.add(self._on_version, (Version,))
+		self._responses = ResponseTracker()
+		self._listeners.add(self._responses.resolve, ResponseTracker.RESPONSE_TYPES)
+		# Deadlines of control commands, (deadline, sequence, key, future, timeout), served by one thread.
+		self._deadlines: List[tuple] = []
+		self._deadlines_changed = Condition()
+		self._deadline_thread: Optional[Thread] = None
 
-		self._serial = serial.Serial(port, baudrate, timeout=timeout)
-		sleep(self.STARTUP_DELAY)
+		if transport is not None:
+			# A serial-like object such as simulated_device.LoopbackSerial; it has no boot delay.
+			self._serial = transport
+			self._ready.set()
+		else:
+			self._serial = serial.Serial(port, baudrate, timeout=timeout)
 		self._reader_thread: Optional[Thread] = Thread(target=self._serial_reader, daemon=True)
 		self._reader_thread.start()
+		self._writer_thread: Optional[Thread] = Thread(target=self._serial_writer, daemon=True)
+		self._writer_thread.start()
+		if transport is None:
+			self.wait_until_ready(startup_timeout)
+
+	def wait_until_ready(self, timeout: float = STARTUP_TIMEOUT) -> bool:
+		"""Probe the board with version requests, backing off, until it answers or timeout passes.
+
+		Returns False on timeout; the client stays usable, as with firmware
+		that does not answer 'p'.
+		"""
+		deadline = monotonic() + timeout
+		interval = self.PROBE_INTERVAL
+		while not self._ready.is_set():
+			remaining = deadline - monotonic()
+			if remaining <= 0:
+				return False
+			self._write_command(protocol.REQUEST_VERSION)
+			self._ready.wait(min(interval, remaining))
+			interval = min(interval * 2, self.MAX_PROBE_INTERVAL)
+		return True
+
+	@property
+	def ready(self) -> bool:
+		return self._ready.is_set()
+
+	def _on_version(self, event: Version):
+		self.version = event.version
+		self._ready.set()
 
 	def close(self):
+		if self._writer_thread and self._writer_thread.is_alive():
+			self._send_queue.put((_PRIORITY_STOP, next(self._send_sequence), None, 0))
+			self._writer_thread.join(timeout=1.0)
 		self._stop_event.set()
+		with self._deadlines_changed:
+			self._deadlines_changed.notify()
 		if self._reader_thread and self._reader_thread.is_alive():
 			self._reader_thread.join(timeout=0.5)
 		if self._serial and self._serial.is_open:
 			self._serial.close()
+		if self._owns_log_sink:
+			release_shared(self._log_sink)
+			self._owns_log_sink = False
+		if self.capture:
+			self.capture.close()
+		self._responses.fail_all(ConnectionError("device client closed"))
 
-	def add_listener(self, callback: Callable[[str]]):
-		self._listeners.append(callback)
+	def set_capture(self, capture_path: Optional[Path]):
+		"""Switch the binary capture to a new file, or stop it with None, without reconnecting."""
+		previous = self.capture
+		self.capture = CaptureWriter(capture_path) if capture_path else None
+		if previous:
+			previous.close()
+
+	def add_listener(self, callback: Callable[[DeviceEvent]], *event_types: type):
+		"""Call callback for every event, or only for events of the given protocol types."""
+		self._listeners.add(callback, event_types)
+
+	def remove_listener(self, callback: Callable[[DeviceEvent]]):
+		self._listeners.remove(callback)
 
 	def add_history_listeners(self, callback: Callable[[str, str]]):
 		self._history_listeners.append(callback)
 
-	def reset(self):
-		self._write_command("r")
+	# The control commands return a Future that resolves with the device's
+	# answer (Reset, Version, Address or Config event) or fails with
+	# TimeoutError, or with the error if writing to the port failed; callers
+	# that do not care can ignore it.
+	def reset(self, timeout: Optional[float] = COMMAND_TIMEOUT) -> Future:
+		return self._request(protocol.RESET, protocol.RESET_KEY, timeout)
 
-	def request_version(self):
-		self._write_command("p")
+	def request_version(self, timeout: Optional[float] = COMMAND_TIMEOUT) -> Future:
+		return self._request(protocol.REQUEST_VERSION, protocol.VERSION_KEY, timeout)
 
-	def request_address(self):
-		self._write_command("a")
+	def request_address(self, timeout: Optional[float] = COMMAND_TIMEOUT) -> Future:
+		return self._request(protocol.REQUEST_ADDRESS, protocol.ADDRESS_KEY, timeout)
 
-	def set_device_address(self, address: str):
-		self._write_command(f"a[{address}]")
+	def set_device_address(self, address: str, timeout: Optional[float] = COMMAND_TIMEOUT) -> Future:
+		return self._request(protocol.encode_set_address(address), protocol.ADDRESS_KEY, timeout)
 
-	def send_text(self, message: str, destination: str):
-		dest = destination
-		command = f"m[{message}\0,{dest}]"
-		self._write_command(command)
+	def send_text(self, message: str, destination: str, block: bool = True, timeout: Optional[float] = None):
+		"""Queue a data frame; raises queue.Full if the send queue stays full (block=False or timeout)."""
+		started_ns = perf_counter_ns() if self.instrumentation is not None else 0
+		if self.compression_stats is not None:
+			payload = payload_codec.compress_payload(message)
+			self.compression_stats.record(len(message), len(payload))
+			message = payload
+		self._write_command(protocol.encode_text(message, destination), started_ns, PRIORITY_DATA, block, timeout)
+
+	def send_bytes(self, data: bytes, destination: str, block: bool = True, timeout: Optional[float] = None):
+		"""Queue a data frame carrying arbitrary bytes, see payload_codec; read them back with decode_payload()."""
+		self.send_text(payload_codec.encode_payload(data), destination, block, timeout)
+
+	def configure(self, group: int, parameter: int, value: int, timeout: Optional[float] = COMMAND_TIMEOUT) -> Future:
+		return self._request(protocol.encode_config(group, parameter, value), protocol.config_key(group, parameter), timeout)
+
+	def configure_many(self, settings: Iterable[Tuple[int, int, int]], timeout: Optional[float] = COMMAND_TIMEOUT) -> List[Config]:
+		"""Apply (group, parameter, value) settings and block until the device confirmed each one.
 
-	def configure(self, group: int, parameter: int, value: int):
-		command = f"c[{group},{parameter},{value}]"
+		All commands are queued before waiting, so they go out in one batched
+		write; raises TimeoutError if any of them is not confirmed in time.
+		"""
+		futures = [self.configure(group, parameter, value, timeout) for group, parameter, value in settings]
+		return [future.result() for future in futures]
+
+	def _request(self, command: str, key: tuple, timeout: Optional[float]) -> Future:
+		future: Future = Future()
+		self._responses.expect(key, future)
+		if timeout is not None:
+			with self._deadlines_changed:
+				heappush(self._deadlines, (monotonic() + timeout, next(self._send_sequence), key, future, timeout))
+				if self._deadline_thread is None:
+					self._deadline_thread = Thread(target=self._expire_requests, daemon=True)
+					self._deadline_thread.start()
+				self._deadlines_changed.notify()
 		self._write_command(command)
+		return future
+
+	def _expire_requests(self):
+		while True:
+			with self._deadlines_changed:
+				while not self._stop_event.is_set():
+					# Answered commands leave their entry behind; drop those as they come up.
+					while self._deadlines and self._deadlines[0][3].done():
+						heappop(self._deadlines)
+					if self._deadlines and self._deadlines[0][0] <= monotonic():
+						break
+					self._deadlines_changed.wait(self._deadlines[0][0] - monotonic() if self._deadlines else None)
+				if self._stop_event.is_set():
+					return
+				_, _, key, future, timeout = heappop(self._deadlines)
+			self._responses.expire(key, future, timeout)
+
+	def flush(self):
+		"""Block until every queued command has been written to the device."""
+		self._send_queue.join()
+
+	def _write_command(self, command: str, started_ns: int = 0, priority: int = PRIORITY_CONTROL, block: bool = True, timeout: Optional[float] = None):
+		if self.instrumentation is not None and not started_ns:
+			started_ns = perf_counter_ns()
+		self._send_queue.put((priority, next(self._send_sequence), command, started_ns), block, timeout)
+
+	def _serial_writer(self):
+		while True:
+			batch = [self._send_queue.get()]
+			size = 0
+			while batch[-1][2] is not None and size < self.MAX_BATCH_BYTES:
+				try:
+					item = self._send_queue.get_nowait()
+				except Empty:
+					break
+				batch.append(item)
+				size += len(item[2] or "")
+			commands = [item[2] for item in batch if item[2] is not None]
+			try:
+				if commands:
+					self._write_batch(commands, batch)
+			except Exception as exc:
+				# The batch is lost, e.g. the device was unplugged: log it and stop waiting for answers.
+				self._log_sink.log("error", f"writing {len(commands)} command(s) failed: {exc!r}")
+				self._responses.fail_all(exc)
+			finally:
+				for _ in batch:
+					self._send_queue.task_done()
+			if batch[-1][2] is None:
+				return
+
+	def _write_batch(self, commands: List[str], batch):
+		instrumentation = self.instrumentation
+		data = "".join(f"{command}\n" for command in commands).encode("ascii", errors="replace")
+		if instrumentation is None:
+			self._serial.write(data)
+			self._serial.flush()
+			for command in commands:
+				self._append_to_log_and_history("to device", command)
+			return
 
-	def _write_command(self, command: str):
-		data = f"{command}\n".encode("ascii", errors="replace")
+		encoded_ns = perf_counter_ns()
 		self._serial.write(data)
+		written_ns = perf_counter_ns()
 		self._serial.flush()
-		self._append_to_log_and_history("to device", command)
-
-	def _emit(self, message: str):
-		for callback in self._listeners:
-			callback(message)
+		flushed_ns = perf_counter_ns()
+		for command in commands:
+			self._append_to_log_and_history("to device", command)
+		for _, _, command, started_ns in batch:
+			if command is not None:
+				instrumentation.record("enqueue", encoded_ns - started_ns)
+		instrumentation.record("write", written_ns - encoded_ns)
+		instrumentation.record("flush", flushed_ns - written_ns)
 
 	def _serial_reader(self):
 		assert self._serial is not None
+		parser = FrameParser()
 		while not self._stop_event.is_set():
+			instrumentation = self.instrumentation
 			try:
-				line = self._serial.readline()
+				# Take everything buffered at once; read(1) waits up to the port timeout when idle.
+				waiting = self._serial.in_waiting
+				# Only a read of bytes already buffered is timed; a read that waited for data measures the link, not the host.
+				read_started_ns = perf_counter_ns() if instrumentation is not None and waiting else 0
+				data = self._serial.read(waiting or 1)
 			except serial.SerialException:
 				if self._stop_event.is_set():
 					break
 				continue
 			except Exception:
 				break
-			if not line:
+			if not data:
+				continue
+			if instrumentation is not None:
+				self._instrumented_receive(instrumentation, parser, data, read_started_ns)
 				continue
-			text = line.decode("ascii", errors="replace").strip()
-			if text:
-				self._append_to_log_and_history("from device", text)
-				self._emit(text)
+			for event in parser.feed(data):
+				self._append_to_log_and_history("from device", event.raw)
+				self._listeners.emit(event)
+
+	def _instrumented_receive(self, instrumentation: Instrumentation, parser: FrameParser, data: bytes, read_started_ns: int):
+		read_ns = perf_counter_ns()
+		events = parser.feed(data)
+		decoded_ns = perf_counter_ns()
+		if read_started_ns:
+			instrumentation.record("read", read_ns - read_started_ns)
+		instrumentation.record("decode", decoded_ns - read_ns)
+		for event in events:
+			started_ns = perf_counter_ns()
+			self._append_to_log_and_history("from device", event.raw)
+			logged_ns = perf_counter_ns()
+			self._listeners.emit(event)
+			instrumentation.record("log", logged_ns - started_ns)
+			instrumentation.record("dispatch", perf_counter_ns() - logged_ns)
 
 	def _append_to_log_and_history(self, direction: str, payload: str):
-		timestamp = datetime.now().strftime("%H:%M:%S")
-		line = f"[{timestamp}] [{direction}]: {payload}"
-		with self._log_path.open("a", encoding="ascii", errors="replace") as handle:
-			handle.write(line.replace("\0", "<NUL>") + "\n")
+		self._log_sink.log(direction, payload)
+		capture = self.capture
+		if capture:
+			capture.write_line(direction, payload)
 
 		for callback in self._history_listeners:
 			callback(direction, payload)
\ No newline at end of file
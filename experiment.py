@@ -1,39 +1,64 @@
 import tkinter as tk
 from pathlib import Path
-from time import monotonic, sleep
 from threading import Thread
 from device_client import DeviceClient
+from experiment_session import WINDOW_WARNING, ExperimentSession
+from profiles import DEFAULT_PROFILES, PARAMETERS, DeviceConfiguration, Profile, get_profile
+from tk_support import EventBridge
 
 class ExperimentUI(tk.Tk):
 
-    THRESHOLD_TIMEOUT = 10
+    THRESHOLD_TIMEOUT = ExperimentSession.THRESHOLD_TIMEOUT
+    STATS_REFRESH_MS = 500
+    # Parameters shown in the two configuration rows.
+    CONFIG_ROWS = ("phy.channel_busy_threshold", "phy.fec_threshold")
 
     def __init__(self):
         super().__init__()
         self.title("Experiment Control Panel")
-        self.geometry("550x350")
+        self.geometry("550x500")
 
         self.filename_var = tk.StringVar()
         self.payload_size_var = tk.IntVar(value=0)
         self.counter = tk.IntVar(value=0)
+        self.stats_var = tk.StringVar(value="")
+        self.window_size_var = tk.IntVar(value=1)
+        self.timeout_var = tk.DoubleVar(value=self.THRESHOLD_TIMEOUT)
+        self.capture_var = tk.BooleanVar(value=False)
         self.port_var = tk.StringVar(value="/dev/tty.usbmodem101")
 
-        self.config_group_var = tk.StringVar(value="0")
-        self.config_param_var = tk.StringVar(value="2")
-        self.config_value_var = tk.StringVar(value="20")
-
-        self.config_group_var2 = tk.StringVar(value="0")
-        self.config_param_var2 = tk.StringVar(value="1")
-        self.config_value_var2 = tk.StringVar(value="0")
-
+        # The configuration rows start out with the values of the "experiment" profile; its
+        # other parameters are applied along with them.
+        self._base_profile = get_profile("experiment")
+        defaults = DEFAULT_PROFILES["experiment"].settings
+        (group, parameter, value), (group2, parameter2, value2) = [
+            (*PARAMETERS[name], self._base_profile.settings.get(name, defaults[name])) for name in self.CONFIG_ROWS
+        ]
+        self.config_group_var = tk.StringVar(value=str(group))
+        self.config_param_var = tk.StringVar(value=str(parameter))
+        self.config_value_var = tk.StringVar(value=str(value))
+
+        self.config_group_var2 = tk.StringVar(value=str(group2))
+        self.config_param_var2 = tk.StringVar(value=str(parameter2))
+        self.config_value_var2 = tk.StringVar(value=str(value2))
+
+        # The connection stays open between runs on the same port, so the
+        # board is not rebooted and only changed parameters are sent again.
         self._client = None
+        self._client_port = None
+        self._device_config = None
+        self._session = None
+        # Set while a worker thread owns the connection (connecting, or waiting for
+        # the last ACKs of a stopped run); Start waits for it to report back.
+        self._busy = False
+        self._finish_thread = None
+        self._run_id = 0
+        self._warning = ""
+        self.bridge = EventBridge(self)
+        self.protocol("WM_DELETE_WINDOW", self.close)
         self.payload_int = 0
-        self.counter_int = 0
         self.filename = "output.txt"
         self.running = False
-        self.sending = False
-        self.file = None
-        self._sender_thread = None
 
         self._destination = "00"
 
@@ -45,13 +70,23 @@ class ExperimentUI(tk.Tk):
         self.filename_entry = tk.Entry(self, textvariable=self.filename_var, width=40)
         self.filename_entry.insert(0, "output.txt")
         self.filename_entry.grid(row=1, column=1, sticky="w")
+        self.capture_check = tk.Checkbutton(self, text="Binary capture", variable=self.capture_var)
+        self.capture_check.grid(row=1, column=2, sticky="w")
 
         tk.Label(self, text="Payload size:").grid(row=2, column=0, sticky="w", pady=(8,0))
         self.payload_entry = tk.Entry(self, textvariable=self.payload_size_var, width=15)
         self.payload_entry.grid(row=2, column=1, sticky="w", pady=(8,0))
 
+        tk.Label(self, text="Window size:").grid(row=3, column=0, sticky="w", pady=(8,0))
+        self.window_entry = tk.Entry(self, textvariable=self.window_size_var, width=15)
+        self.window_entry.grid(row=3, column=1, sticky="w", pady=(8,0))
+
+        tk.Label(self, text="Timeout (s):").grid(row=4, column=0, sticky="w", pady=(8,0))
+        self.timeout_entry = tk.Entry(self, textvariable=self.timeout_var, width=15)
+        self.timeout_entry.grid(row=4, column=1, sticky="w", pady=(8,0))
+
         self.configure_box = tk.LabelFrame(self, text="Configure: channel busy threshold")
-        self.configure_box.grid(row=3, column=0, columnspan=2, sticky="ew", pady=(0, 16))
+        self.configure_box.grid(row=5, column=0, columnspan=2, sticky="ew", pady=(0, 16))
         self.configure_box.columnconfigure(0, weight=0)
         self.configure_box.columnconfigure(1, weight=0)
         self.configure_box.columnconfigure(2, weight=0)
@@ -65,7 +100,7 @@ class ExperimentUI(tk.Tk):
         self.value_entry.grid(row=0, column=2, padx=(0, 8), pady=4)
 
         self.configure_box2 = tk.LabelFrame(self, text="Configure: Forward Error Correction")
-        self.configure_box2.grid(row=4, column=0, columnspan=2, sticky="ew", pady=(0, 16))
+        self.configure_box2.grid(row=6, column=0, columnspan=2, sticky="ew", pady=(0, 16))
         self.configure_box2.columnconfigure(0, weight=0)
         self.configure_box2.columnconfigure(1, weight=0)
         self.configure_box2.columnconfigure(2, weight=0)
@@ -79,107 +114,184 @@ class ExperimentUI(tk.Tk):
         self.value_entry2.grid(row=0, column=2, padx=(0, 8), pady=4)
 
         self.start_button = tk.Button(self, text="Start", width=12, command=self.toggle)
-        self.start_button.grid(row=5, column=0, columnspan=3, pady=(12,6))
+        self.start_button.grid(row=7, column=0, columnspan=3, pady=(12,6))
 
-        tk.Label(self, text="Counter:").grid(row=6, column=0, sticky="w")
+        tk.Label(self, text="Counter:").grid(row=8, column=0, sticky="w")
         self.counter_label = tk.Label(self, textvariable=self.counter, font=("Helvetica", 16))
-        self.counter_label.grid(row=6, column=1, sticky="w")
+        self.counter_label.grid(row=8, column=1, sticky="w")
+
+        tk.Label(self, text="Statistics:").grid(row=9, column=0, sticky="nw")
+        self.stats_label = tk.Label(self, textvariable=self.stats_var, justify="left", font=("Courier", 11))
+        self.stats_label.grid(row=9, column=1, columnspan=2, sticky="w")
 
     def toggle(self):
         if not self.running:
 
+            try:
+                rows = Profile.from_commands("experiment", [
+                    (self.config_group_var.get(), self.config_param_var.get(), self.config_value_var.get()),
+                    (self.config_group_var2.get(), self.config_param_var2.get(), self.config_value_var2.get()),
+                ])
+                profile = self._base_profile.merged(rows.settings)
+            except ValueError as exc:
+                self.stats_var.set(f"Invalid configuration: {exc}")
+                return
+
+            if self._busy:
+                return
             self.running = True
+            self._run_id += 1
             self.start_button.config(text="Stop")
-            self.filename_entry.config(state="disabled")
-            self.payload_entry.config(state="disabled")
-            self.port_entry.config(state="disabled")
-
-            port = self.port_var.get().strip()
-            self._client = DeviceClient(port=port)
-
-            sleep(2)
-
-            self._client.configure(self.config_group_var.get(),self.config_param_var.get(),self.config_value_var.get())
-            self._client.configure(self.config_group_var2.get(),self.config_param_var2.get(),self.config_value_var2.get())
+            self._set_inputs_state("disabled")
 
             self.filename = self.filename_var.get().strip()
-            self.payload_int = int(self.payload_size_var.get())
-            self.counter_int = 0
-            self.counter.set(self.counter_int)
-
             self._entry_filename = Path("output") / self.filename
-            try:
-                self._entry_filename.parent.mkdir(parents=True, exist_ok=True)
-            except Exception:
-                pass
-            try:
-                self.file = self._entry_filename.open("w", encoding="ascii", errors="replace")
-            except Exception:
-                self.file = None
+            capture_path = self._entry_filename.with_name(self._entry_filename.name + ".vlcc") if self.capture_var.get() else None
+            if capture_path:
+                capture_path.unlink(missing_ok=True)
 
-            self._client.add_listener(self._on_device_message)
-            t = Thread(target=self._sender_loop, daemon=True)
-            t.start()
-            self._sender_thread = t
+            port = self.port_var.get().strip()
+
+            self.payload_int = int(self.payload_size_var.get())
+            self.counter.set(0)
+            self.stats_var.set("Connecting...")
+            session_options = dict(
+                window_size=int(self.window_size_var.get()),
+                timeout=float(self.timeout_var.get()),
+                destination=self._destination,
+            )
+            # The worker owns the connection until _connected() hands it back.
+            connection = (self._client, self._client_port, self._device_config)
+            self._client = self._client_port = self._device_config = None
+            self._busy = True
+            # Opening the port waits for the board to boot; keep that off the Tk thread.
+            Thread(target=self._connect, args=(connection, port, capture_path, profile, session_options), daemon=True).start()
 
         else:
             self.running = False
-            self.start_button.config(text="Start")
-            self.filename_entry.config(state="normal")
-            self.payload_entry.config(state="normal")
-            self.port_entry.config(state="normal")
-
-            if self._client:
-                self._client.close()
-                self._client = None
-
-            if self.file:
-                self.file.close()
-                self.file = None
-
-            self.sending = False
-            if self._sender_thread and self._sender_thread.is_alive():
-                try:
-                    self._sender_thread.join(timeout=1.0)
-                except Exception:
-                    pass
-            self._sender_thread = None
-
-
-    def _on_device_message(self, message: str):
-        if not message.startswith("m["):
+            self._set_inputs_state("normal")
+
+            if self._session:
+                # Frames still in flight are ACKed or time out before the connection is reused,
+                # so none of their ACKs reach the next run; that can take up to twice the timeout.
+                session, self._session = self._session, None
+                self._busy = True
+                self.stats_var.set("Waiting for the last ACKs...")
+                self._finish_thread = Thread(target=self._finish, args=(session, self._client), daemon=True)
+                self._finish_thread.start()
+            elif self._client:
+                self._client.set_capture(None)
+
+            # Start stays disabled until a worker that owns the connection is done.
+            self.start_button.config(text="Start", state="disabled" if self._busy else "normal")
+
+    def _set_inputs_state(self, state: str):
+        for entry in (self.filename_entry, self.payload_entry, self.window_entry, self.timeout_entry, self.capture_check, self.port_entry):
+            entry.config(state=state)
+
+    def _connect(self, connection, port, capture_path, profile, session_options):
+        client, client_port, device_config = connection
+        if client and client_port != port:
+            device_config.close()
+            client.close()
+            client = None
+        if client is None:
+            try:
+                client = DeviceClient(port=port)
+            except Exception as exc:
+                self.bridge.post(self._connect_failed, exc)
+                return
+            device_config = DeviceConfiguration(client)
+        warning = ""
+        try:
+            client.set_capture(capture_path)
+            device_config.apply(profile)
+        except TimeoutError as exc:
+            # The device state is unknown now; send the whole profile next time.
+            device_config.invalidate()
+            warning = f"Configuration not confirmed: {exc}"
+        except Exception as exc:
+            # E.g. a failed write or capture file; the worker must always report back.
+            device_config.close()
+            client.close()
+            self.bridge.post(self._connect_failed, exc)
             return
-        body = message[2:-1] if message.endswith("]") else message[2:]
-        parts = body.split(",", 2)
-        if len(parts) < 2:
+        self.bridge.post(self._connected, (client, port, device_config), session_options, warning)
+
+    def _connected(self, connection, session_options, warning):
+        self._client, self._client_port, self._device_config = connection
+        self._busy = False
+        self.start_button.config(state="normal")
+        if not self.running:
+            # Stopped while the board was still booting.
+            self._client.set_capture(None)
+            return
+        if session_options["window_size"] > 1:
+            warning = f"{warning}\n{WINDOW_WARNING}" if warning else WINDOW_WARNING
+        self._warning = warning
+        self.stats_var.set(warning)
+        self._session = ExperimentSession(
+            self._client,
+            self._entry_filename,
+            self.payload_int,
+            # Called from the sender thread for every frame; the bridge sets the Tk variable.
+            on_sent=lambda sent: self.bridge.post_latest("sent", self.counter.set, sent),
+            **session_options,
+        )
+        self._session.start()
+        self.after(self.STATS_REFRESH_MS, self._refresh_stats, self._run_id)
+
+    def _connect_failed(self, error: Exception):
+        self._busy = False
+        self.start_button.config(state="normal")
+        if self.running:
+            self.toggle()
+        self.stats_var.set(f"Could not start the run: {error}")
+
+    def _finish(self, session, client):
+        summary = session.stop()
+        client.set_capture(None)
+        self.bridge.post(self._finished, summary)
+
+    def _finished(self, summary):
+        self._busy = False
+        self.start_button.config(state="normal")
+        self.stats_var.set(self._format_stats(summary))
+
+    def close(self):
+        # The run's summary and last timeouts are written before the client goes away;
+        # this can take up to twice the timeout, like Stop.
+        self.running = False
+        if self._session:
+            self._session.stop()
+            self._session = None
+        if self._finish_thread:
+            self._finish_thread.join()
+        if self._client:
+            self._device_config.close()
+            self._client.close()
+            self._client = None
+        self.bridge.close()
+        self.destroy()
+
+    def _refresh_stats(self, run_id: int):
+        if run_id != self._run_id:
             return
-        if parts[0] == "R" and parts[1] == "A":
-            receive_time = monotonic()
-            rtt = (receive_time - getattr(self, "time", receive_time)) * 1000
-            log_line = f"{rtt:.5f}\n"
-            if self.file:
-                self.file.write(log_line)
-                self.file.flush()
-            self.sending = False
-
-    def _sender_loop(self):
-        while self.running:
-            if self.payload_int > 0 and not self.sending:
-                sleep(0.01)
-                message = "A" * self.payload_int
-                self.sending = True
-                self.time = monotonic()
-                self._client.send_text(message, self._destination)
-                self.counter_int += 1
-                self.counter.set(self.counter_int)
-            if self.sending and hasattr(self, "time"):
-                if monotonic() - self.time > self.THRESHOLD_TIMEOUT:
-                    now = monotonic()
-                    if self.file:
-                        self.file.write(f"{self.THRESHOLD_TIMEOUT}\n")
-                        self.file.flush()
-                    self.time = now
-                    self.sending = False
-
-app = ExperimentUI()
-app.mainloop()
\ No newline at end of file
+        if self._session:
+            stats = self._format_stats(self._session.run_stats.summary())
+            self.stats_var.set(f"{self._warning}\n{stats}" if self._warning else stats)
+        if self.running:
+            self.after(self.STATS_REFRESH_MS, self._refresh_stats, run_id)
+
+    @staticmethod
+    def _format_stats(summary) -> str:
+        return (
+            f"RTT mean {summary['rtt_mean_ms']:.2f} ms, sd {summary['rtt_stddev_ms']:.2f} ms\n"
+            f"p50 {summary['rtt_p50_ms']:.2f}  p90 {summary['rtt_p90_ms']:.2f}  p99 {summary['rtt_p99_ms']:.2f} ms\n"
+            f"acked {summary['acked']}, timeouts {summary['timeouts']} ({summary['loss_rate']:.1%}), "
+            f"late {summary['late']}, dup {summary['duplicates']}"
+        )
+
+if __name__ == "__main__":
+    app = ExperimentUI()
+    app.mainloop()
@@ -0,0 +1,190 @@
+import json
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Callable, Optional
+
+from capture import RESULT_ACK, RESULT_LATE, RESULT_TIMEOUT
+from inflight import ACKED, LATE, InFlightTable
+from online_stats import RunStatistics
+from protocol import Ack
+
+# ACK lines name no frame, see InFlightTable: with more than one frame in
+# flight, RTTs after a lost frame belong to the frame sent after it.
+WINDOW_WARNING = "Window > 1: after a lost frame, RTTs are charged to the wrong frames"
+
+
+class ExperimentSession:
+    """One RTT measurement run over an open DeviceClient.
+
+    Sends payload_size byte frames with up to window_size of them in
+    flight, writes one RTT or timeout (both in ms) per line to output_path and
+    keeps live statistics in run_stats. With max_frames set, the run ends
+    by itself once that many frames are acknowledged or timed out.
+    stop() waits for the ACKs of frames still in flight (up to the timeout,
+    plus the late grace of frames that timed out), so the client can be
+    reused for the next session without its frames getting them.
+    """
+
+    THRESHOLD_TIMEOUT = 10
+
+    def __init__(
+        self,
+        client,
+        output_path,
+        payload_size: int,
+        window_size: int = 1,
+        timeout: float = THRESHOLD_TIMEOUT,
+        destination: str = "00",
+        max_frames: Optional[int] = None,
+        on_sent: Optional[Callable[[int], None]] = None,
+    ):
+        self.client = client
+        self.output_path = Path(output_path)
+        self.payload_size = payload_size
+        self.window_size = max(1, window_size)
+        self.timeout = timeout
+        self.destination = destination
+        self.max_frames = max_frames
+        self.on_sent = on_sent
+
+        self.running = False
+        self.finished = Event()
+        self.sent = 0
+        self.run_stats = RunStatistics()
+        self.file = None
+        self.late_file = None
+        self._file_lock = Lock()
+        self._next_seq = 0
+        self._in_flight = InFlightTable(late_grace_ns=self._timeout_ns())
+        self._sender_thread: Optional[Thread] = None
+
+    def start(self):
+        try:
+            self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        except Exception:
+            pass
+        try:
+            self.file = self.output_path.open("w", encoding="ascii", errors="replace")
+        except Exception:
+            self.file = None
+        try:
+            self.late_file = self._sibling(".late").open("w", encoding="ascii", errors="replace")
+        except Exception:
+            self.late_file = None
+
+        self.running = True
+        self.client.add_listener(self._on_ack, Ack)
+        self._sender_thread = Thread(target=self._sender_loop, daemon=True)
+        self._sender_thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.finished.wait(timeout)
+
+    def stop(self) -> dict:
+        self.running = False
+        self._in_flight.wake()
+        if self._sender_thread and self._sender_thread.is_alive():
+            try:
+                self._sender_thread.join(timeout=1.0)
+            except Exception:
+                pass
+        self._sender_thread = None
+        self._record_timeouts(self._in_flight.settle(self._timeout_ns()))
+        self.client.remove_listener(self._on_ack)
+
+        with self._file_lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+            if self.late_file:
+                self.late_file.close()
+                self.late_file = None
+        return self._write_summary()
+
+    def _sibling(self, suffix: str) -> Path:
+        return self.output_path.with_name(self.output_path.name + suffix)
+
+    def _timeout_ns(self) -> int:
+        return int(self.timeout * 1_000_000_000)
+
+    def _on_ack(self, event: Ack):
+        outcome, frame_id, rtt_ns = self._in_flight.ack()
+        if outcome == ACKED:
+            self.run_stats.record_rtt(rtt_ns / 1_000_000)
+        elif outcome == LATE:
+            self.run_stats.record_late()
+        else:
+            self.run_stats.record_duplicate()
+        capture = self.client.capture
+        if capture and outcome == ACKED:
+            capture.write_result(RESULT_ACK, frame_id, rtt_ns / 1_000_000, self.payload_size)
+        elif capture and outcome == LATE:
+            capture.write_result(RESULT_LATE, frame_id, rtt_ns / 1_000_000, self.payload_size)
+        with self._file_lock:
+            if outcome == ACKED:
+                if self.file:
+                    self.file.write(f"{rtt_ns / 1_000_000:.5f}\n")
+                    self.file.flush()
+            elif self.late_file:
+                if outcome == LATE:
+                    self.late_file.write(f"late,{frame_id},{rtt_ns / 1_000_000:.5f}\n")
+                else:
+                    self.late_file.write("duplicate,,\n")
+                self.late_file.flush()
+        if outcome == ACKED:
+            self._check_finished()
+
+    def _expire_frames(self):
+        self._record_timeouts(self._in_flight.expire(self._timeout_ns()))
+
+    def _record_timeouts(self, expired):
+        if not expired:
+            return
+        self.run_stats.record_timeouts(len(expired))
+        capture = self.client.capture
+        if capture:
+            for frame_id in expired:
+                capture.write_result(RESULT_TIMEOUT, frame_id, self.timeout * 1000, self.payload_size)
+        with self._file_lock:
+            if self.file:
+                for _ in expired:
+                    self.file.write(f"{self.timeout * 1000:g}\n")
+                self.file.flush()
+        self._check_finished()
+
+    def _check_finished(self):
+        if self.max_frames is not None and self._next_seq >= self.max_frames and not len(self._in_flight):
+            self.finished.set()
+
+    def _write_summary(self) -> dict:
+        summary = self.run_stats.summary()
+        summary.update(payload_size=self.payload_size, window_size=self.window_size, timeout_s=self.timeout)
+        try:
+            self._sibling(".summary.json").write_text(json.dumps(summary, indent=2))
+        except Exception:
+            pass
+        return summary
+
+    def _sender_loop(self):
+        if self.payload_size <= 0:
+            self.finished.set()
+            return
+        message = "A" * self.payload_size
+        while self.running:
+            self._expire_frames()
+            if self.max_frames is not None and self._next_seq >= self.max_frames:
+                # Everything is sent; only wait for the remaining ACKs or their timeouts.
+                self._check_finished()
+                if self.finished.is_set():
+                    return
+                self._in_flight.wait_for_slot(1, self._timeout_ns())
+                continue
+            if not self._in_flight.wait_for_slot(self.window_size, self._timeout_ns()):
+                continue
+            self._in_flight.open(self._next_seq)
+            self._next_seq += 1
+            self.client.send_text(message, self.destination)
+            self.run_stats.record_sent()
+            self.sent += 1
+            if self.on_sent:
+                self.on_sent(self.sent)
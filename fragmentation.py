@@ -0,0 +1,398 @@
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from threading import Condition, Lock
+from time import monotonic
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import payload_codec
+from inflight import ACKED, InFlightTable
+from protocol import Ack, Data
+
+# Largest payload the firmware takes in one m[...] frame.
+MAX_FRAME = 180
+
+# Every control frame starts with SOH and its kind, then a 16 bit CRC (4 hex
+# digits) over the rest of the frame, so chat text is never mistaken for one
+# and corrupted frames are dropped instead of reassembled.
+FRAGMENT = "\x01F"
+QUERY = "\x01Q"
+STATUS = "\x01S"
+_KINDS = (FRAGMENT, QUERY, STATUS)
+# kind + crc + transfer id + index + fragment count + payload_codec mode
+_FRAGMENT_HEADER = 2 + 4 + 4 + 4 + 4 + 1
+# The body is never longer than base85, which takes 5 characters per 4 bytes.
+FRAGMENT_SIZE = (MAX_FRAME - _FRAGMENT_HEADER) // 5 * 4
+
+
+def _seal(kind: str, body: str) -> str:
+	return f"{kind}{zlib.crc32(body.encode('ascii')) & 0xFFFF:04x}{body}"
+
+
+def _unseal(payload: str) -> Optional[Tuple[str, str]]:
+	kind = payload[:2]
+	if kind not in _KINDS:
+		return None
+	body = payload[6:]
+	try:
+		if int(payload[2:6], 16) != zlib.crc32(body.encode("ascii")) & 0xFFFF:
+			return None
+	except (ValueError, UnicodeEncodeError):
+		return None
+	return kind, body
+
+
+def encode_fragment(transfer_id: int, index: int, total: int, chunk: bytes) -> str:
+	return _seal(FRAGMENT, f"{transfer_id:04x}{index:04x}{total:04x}{payload_codec.encode(chunk)}")
+
+
+def encode_missing(missing: List[int], limit: int = MAX_FRAME - 10) -> str:
+	"""Write sorted fragment indexes as hex ranges ("0-1f,25"), cut off at limit characters."""
+	ranges = []
+	length = 0
+	index = 0
+	while index < len(missing):
+		end = index
+		while end + 1 < len(missing) and missing[end + 1] == missing[end] + 1:
+			end += 1
+		part = f"{missing[index]:x}" if end == index else f"{missing[index]:x}-{missing[end]:x}"
+		length += len(part) + 1
+		if length > limit:
+			break
+		ranges.append(part)
+		index = end + 1
+	return ",".join(ranges)
+
+
+def decode_missing(text: str, total: int) -> List[int]:
+	if text == "*":
+		return list(range(total))
+	missing = []
+	for part in filter(None, text.split(",")):
+		first, _, last = part.partition("-")
+		missing.extend(range(int(first, 16), int(last or first, 16) + 1))
+	return [index for index in missing if index < total]
+
+
+class TransferResult(NamedTuple):
+	transfer_id: int
+	size: int
+	encoded_size: int
+	fragments: int
+	frames_sent: int
+	rounds: int
+	elapsed_s: float
+	complete: bool
+
+	@property
+	def goodput(self) -> float:
+		"""Delivered payload bytes per second (0 if the transfer did not complete)."""
+		return self.size / self.elapsed_s if self.complete and self.elapsed_s > 0 else 0.0
+
+	@property
+	def overhead(self) -> float:
+		"""Characters on the line per payload byte for one copy of every fragment."""
+		return self.encoded_size / self.size if self.size else 0.0
+
+
+class FragmentSender:
+	"""Sends byte payloads of any size over a DeviceClient.
+
+	A payload is cut into numbered, checksummed fragments that each fit one
+	frame. A round pipelines the pending fragments with up to `window`
+	frames awaiting their link ACK and ends with a query; the receiver
+	answers with the fragments it is still missing, and only those are
+	sent again in the next round.
+	"""
+
+	MIN_ACK_TIMEOUT_NS = 50_000_000
+
+	def __init__(
+		self,
+		client,
+		destination: str = "FF",
+		fragment_size: int = FRAGMENT_SIZE,
+		window: int = 8,
+		ack_timeout: float = 2.0,
+		status_timeout: float = 3.0,
+		max_rounds: int = 32,
+	):
+		if not 0 < fragment_size <= FRAGMENT_SIZE:
+			raise ValueError(f"fragment_size must be between 1 and {FRAGMENT_SIZE}")
+		self.client = client
+		self.destination = destination
+		self.fragment_size = fragment_size
+		self.window = max(1, window)
+		self.ack_timeout = ack_timeout
+		self.status_timeout = status_timeout
+		self.max_rounds = max_rounds
+
+		self._in_flight = InFlightTable(late_grace_ns=int(ack_timeout * 1_000_000_000))
+		# Smoothed RTT and its variation (RFC 6298); a frame without an ACK holds its
+		# window slot for srtt + 4 * rttvar, never longer than ack_timeout.
+		self._srtt_ns = 0.0
+		self._rttvar_ns = 0.0
+		# After a frame expires, ACKs may be matched one frame off until the window
+		# drains; like Karn's algorithm, the estimate is not updated in that time.
+		self._rtt_ambiguous = False
+		self._next_frame = 0
+		self._next_transfer = random.randrange(0x10000)
+		self._statuses: Dict[int, str] = {}
+		self._status_changed = Condition()
+		client.add_listener(self._on_ack, Ack)
+		client.add_listener(self._on_data, Data)
+
+	def close(self):
+		self.client.remove_listener(self._on_ack)
+		self.client.remove_listener(self._on_data)
+
+	def send(self, data: bytes) -> TransferResult:
+		chunks = [data[start:start + self.fragment_size] for start in range(0, len(data), self.fragment_size)] or [b""]
+		total = len(chunks)
+		if total > 0xFFFF:
+			raise ValueError(f"payload needs {total} fragments, at most 65535 are supported")
+		transfer_id = self._next_transfer
+		self._next_transfer = (transfer_id + 1) & 0xFFFF
+
+		frames = [encode_fragment(transfer_id, index, total, chunk) for index, chunk in enumerate(chunks)]
+		started = monotonic()
+		pending = list(range(total))
+		frames_sent = 0
+		complete = False
+		rounds = 0
+		while rounds < self.max_rounds:
+			rounds += 1
+			with self._status_changed:
+				self._statuses.pop(transfer_id, None)
+			for index in pending:
+				self._send_frame(frames[index])
+				frames_sent += 1
+			missing = self._query(transfer_id, total)
+			if missing is None:
+				# Neither the query nor an answer got through; ask again without resending.
+				pending = []
+				continue
+			if not missing:
+				complete = True
+				break
+			pending = missing
+		encoded_size = sum(map(len, frames))
+		return TransferResult(transfer_id, len(data), encoded_size, total, frames_sent, rounds, monotonic() - started, complete)
+
+	def _query(self, transfer_id: int, total: int) -> Optional[List[int]]:
+		self._send_frame(_seal(QUERY, f"{transfer_id:04x}"))
+		deadline = monotonic() + self.status_timeout
+		with self._status_changed:
+			while transfer_id not in self._statuses:
+				remaining = deadline - monotonic()
+				if remaining <= 0:
+					return None
+				self._status_changed.wait(remaining)
+			return decode_missing(self._statuses.pop(transfer_id), total)
+
+	def _ack_timeout_ns(self) -> int:
+		limit_ns = int(self.ack_timeout * 1_000_000_000)
+		if not self._srtt_ns:
+			return limit_ns
+		return min(limit_ns, max(self.MIN_ACK_TIMEOUT_NS, int(self._srtt_ns + 4 * self._rttvar_ns)))
+
+	def _send_frame(self, frame: str):
+		timeout_ns = self._ack_timeout_ns()
+		self._expire(timeout_ns)
+		while not self._in_flight.wait_for_slot(self.window, timeout_ns):
+			# A frame that never got its ACK only frees its slot here; the query reports what was lost.
+			self._expire(timeout_ns)
+		self._in_flight.open(self._next_frame)
+		self._next_frame += 1
+		self.client.send_text(frame, self.destination)
+
+	def _on_ack(self, event: Ack):
+		# Frames still open from before a status query must not be credited with this ACK.
+		self._expire(self._ack_timeout_ns())
+		outcome, _, rtt_ns = self._in_flight.ack()
+		if outcome != ACKED:
+			return
+		if self._rtt_ambiguous:
+			self._rtt_ambiguous = bool(len(self._in_flight))
+			return
+		if not self._srtt_ns:
+			self._srtt_ns = rtt_ns
+			self._rttvar_ns = rtt_ns / 2
+		else:
+			self._rttvar_ns = 0.75 * self._rttvar_ns + 0.25 * abs(self._srtt_ns - rtt_ns)
+			self._srtt_ns = 0.875 * self._srtt_ns + 0.125 * rtt_ns
+
+	def _expire(self, timeout_ns: int):
+		if self._in_flight.expire(timeout_ns):
+			self._rtt_ambiguous = True
+
+	def _on_data(self, event: Data):
+		frame = _unseal(event.payload)
+		if frame is None or frame[0] != STATUS:
+			return
+		body = frame[1]
+		try:
+			transfer_id = int(body[:4], 16)
+		except ValueError:
+			return
+		with self._status_changed:
+			self._statuses[transfer_id] = body[4:]
+			self._status_changed.notify_all()
+
+
+class _Reassembly:
+
+	__slots__ = ("chunks", "received", "updated")
+
+	def __init__(self, total: int):
+		self.chunks: List[Optional[bytes]] = [None] * total
+		self.received = 0
+		self.updated = monotonic()
+
+	def missing(self) -> List[int]:
+		return [index for index, chunk in enumerate(self.chunks) if chunk is None]
+
+
+class FragmentReceiver:
+	"""Reassembles payloads sent by a FragmentSender on the other device.
+
+	Fragments may arrive out of order or more than once. on_message gets
+	(transfer_id, payload) once every fragment is in, and each query is
+	answered with a status frame to reply_to listing what is missing.
+	Transfers without a new fragment for transfer_timeout seconds are dropped.
+	"""
+
+	COMPLETED_HISTORY = 64
+
+	def __init__(self, client, on_message: Callable[[int, bytes], None], reply_to: str = "FF", transfer_timeout: float = 60.0):
+		self.client = client
+		self.on_message = on_message
+		self.reply_to = reply_to
+		self.transfer_timeout = transfer_timeout
+
+		self._transfers: Dict[int, _Reassembly] = {}
+		self._completed: "OrderedDict[int, None]" = OrderedDict()
+		self._lock = Lock()
+		client.add_listener(self._on_data, Data)
+
+	def close(self):
+		self.client.remove_listener(self._on_data)
+
+	def _on_data(self, event: Data):
+		frame = _unseal(event.payload)
+		if frame is None:
+			return
+		kind, body = frame
+		try:
+			transfer_id = int(body[:4], 16)
+			if kind == FRAGMENT:
+				self._on_fragment(transfer_id, int(body[4:8], 16), int(body[8:12], 16), payload_codec.decode(body[12:]))
+			elif kind == QUERY:
+				self._on_query(transfer_id)
+		except ValueError:
+			return
+
+	def _on_fragment(self, transfer_id: int, index: int, total: int, chunk: bytes):
+		delivered = None
+		with self._lock:
+			self._drop_stale()
+			if transfer_id in self._completed:
+				return
+			transfer = self._transfers.get(transfer_id)
+			if transfer is None or len(transfer.chunks) != total:
+				transfer = self._transfers[transfer_id] = _Reassembly(total)
+			if index >= total:
+				return
+			transfer.updated = monotonic()
+			if transfer.chunks[index] is None:
+				transfer.chunks[index] = chunk
+				transfer.received += 1
+			if transfer.received == total:
+				delivered = b"".join(transfer.chunks)
+				del self._transfers[transfer_id]
+				self._completed[transfer_id] = None
+				if len(self._completed) > self.COMPLETED_HISTORY:
+					self._completed.popitem(last=False)
+		if delivered is not None:
+			self.on_message(transfer_id, delivered)
+
+	def _on_query(self, transfer_id: int):
+		with self._lock:
+			if transfer_id in self._completed:
+				missing = ""
+			elif transfer_id in self._transfers:
+				missing = encode_missing(self._transfers[transfer_id].missing())
+			else:
+				missing = "*"
+		self.client.send_text(_seal(STATUS, f"{transfer_id:04x}{missing}"), self.reply_to)
+
+	def _drop_stale(self):
+		now = monotonic()
+		for transfer_id in [transfer_id for transfer_id, transfer in self._transfers.items() if now - transfer.updated > self.transfer_timeout]:
+			del self._transfers[transfer_id]
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Measure bulk-transfer goodput with fragmentation and selective retransmit.")
+	parser.add_argument("--sender", help="serial port of the sending device")
+	parser.add_argument("--receiver", help="serial port of the receiving device")
+	parser.add_argument("--simulate", action="store_true", help="use two simulated devices instead of serial ports")
+	parser.add_argument("--latency", type=float, default=0.005, help="simulated per-frame latency in seconds")
+	parser.add_argument("--loss-rate", type=float, default=0.0)
+	parser.add_argument("--bit-error-rate", type=float, default=0.0)
+	parser.add_argument("--size", type=int, default=64 * 1024, help="size of the random payload in bytes")
+	parser.add_argument("--file", type=Path, help="send this file instead of a random payload")
+	parser.add_argument("--fragment-size", type=int, default=FRAGMENT_SIZE)
+	parser.add_argument("--window", type=int, default=8)
+	parser.add_argument("--destination", default="FF")
+	args = parser.parse_args(argv)
+
+	from device_client import DeviceClient
+
+	devices = []
+	if args.simulate:
+		from simulated_device import SimulatedDevice
+
+		devices = [
+			SimulatedDevice("01", args.latency, args.loss_rate, args.bit_error_rate, seed=1),
+			SimulatedDevice("02", args.latency, args.loss_rate, args.bit_error_rate, seed=2),
+		]
+		devices[0].connect(devices[1])
+		sending = DeviceClient(transport=devices[0].loopback())
+		receiving = DeviceClient(transport=devices[1].loopback())
+	elif args.sender and args.receiver:
+		sending = DeviceClient(port=args.sender)
+		receiving = DeviceClient(port=args.receiver)
+	else:
+		parser.error("give --sender and --receiver ports, or --simulate")
+
+	payload = args.file.read_bytes() if args.file else random.Random(0).randbytes(args.size)
+	received = {}
+	receiver = FragmentReceiver(receiving, lambda transfer_id, data: received.update({transfer_id: data}), reply_to=args.destination)
+	sender = FragmentSender(sending, args.destination, args.fragment_size, args.window)
+	try:
+		result = sender.send(payload)
+	finally:
+		sender.close()
+		receiver.close()
+		sending.close()
+		receiving.close()
+		for device in devices:
+			device.close()
+
+	intact = received.get(result.transfer_id) == payload
+	print(
+		f"{result.size} bytes in {result.fragments} fragments: {result.frames_sent} frames sent over {result.rounds} rounds,"
+		f" {result.elapsed_s:.2f} s, goodput {result.goodput:.0f} B/s, {'complete' if result.complete and intact else 'INCOMPLETE'}"
+	)
+	print(f"encoding: {result.encoded_size} characters for {result.size} bytes, {result.overhead:.3f} characters per payload byte")
+	return 0 if result.complete and intact else 1
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from threading import Condition, Lock
+from time import perf_counter_ns
+from typing import List, Optional, Tuple
+
+ACKED = "acked"
+LATE = "late"
+DUPLICATE = "duplicate"
+
+
+class InFlightTable:
+    """Send timestamps of unacknowledged frames, keyed by frame id.
+
+    The device acknowledges its transmissions in order and the ACK line does
+    not name the frame, so an ACK belongs to the oldest outstanding frame.
+    Frames evicted on timeout are remembered for a grace period, but an ACK
+    only counts as late for one of them when no frame is open, or when it
+    comes implausibly soon (under half the shortest RTT seen) after the
+    oldest open frame was sent. With one frame in flight, a lost frame
+    therefore never takes the ACK of the frame sent after it. With more,
+    it cannot be told apart from the frames behind it: until it times out
+    it takes the next frame's ACK, every later ACK is charged to the frame
+    before its own, and the newest frame is reported as the timeout.
+    """
+
+    def __init__(self, late_grace_ns: int = 0):
+        self.late_grace_ns = late_grace_ns
+        self._open: "OrderedDict[int, int]" = OrderedDict()
+        self._evicted: "OrderedDict[int, Tuple[int, int]]" = OrderedDict()
+        self._lock = Lock()
+        self._changed = Condition(self._lock)
+        self._woken = False
+        self._min_rtt_ns = 0
+        self.late: List[Tuple[int, int]] = []
+        self.duplicates = 0
+
+    def __len__(self) -> int:
+        return len(self._open)
+
+    def clear(self):
+        with self._lock:
+            self._open.clear()
+            self._evicted.clear()
+            self.late.clear()
+            self.duplicates = 0
+            self._min_rtt_ns = 0
+            self._woken = False
+            self._changed.notify_all()
+
+    def open(self, frame_id: int, sent_ns: Optional[int] = None):
+        with self._lock:
+            self._open[frame_id] = perf_counter_ns() if sent_ns is None else sent_ns
+
+    def ack(self, received_ns: Optional[int] = None) -> Tuple[str, Optional[int], Optional[int]]:
+        """Match an ACK to its frame and return (outcome, frame_id, rtt_ns).
+
+        Late and duplicate ACKs are also recorded in `late` and `duplicates`.
+        """
+        now = perf_counter_ns() if received_ns is None else received_ns
+        with self._lock:
+            self._forget_evicted(now)
+            if self._open:
+                frame_id, sent_ns = next(iter(self._open.items()))
+                rtt_ns = now - sent_ns
+                if not (self._evicted and rtt_ns < self._min_rtt_ns // 2):
+                    del self._open[frame_id]
+                    if not self._min_rtt_ns or rtt_ns < self._min_rtt_ns:
+                        self._min_rtt_ns = rtt_ns
+                    self._changed.notify_all()
+                    return ACKED, frame_id, rtt_ns
+            if self._evicted:
+                evicted_id, (sent_ns, _) = self._evicted.popitem(last=False)
+                self.late.append((evicted_id, now - sent_ns))
+                self._changed.notify_all()
+                return LATE, evicted_id, now - sent_ns
+            self.duplicates += 1
+            return DUPLICATE, None, None
+
+    def expire(self, timeout_ns: int, now_ns: Optional[int] = None) -> List[int]:
+        """Evict the frames that have waited longer than timeout_ns."""
+        now = perf_counter_ns() if now_ns is None else now_ns
+        with self._lock:
+            self._forget_evicted(now)
+            return self._expire(timeout_ns, now)
+
+    def settle(self, timeout_ns: int) -> List[int]:
+        """Block until no frame is open and the grace period of evicted frames is over.
+
+        Open frames still expire after timeout_ns; their ids are returned.
+        Call it before the ACK listener goes away, so that no ACK of these
+        frames reaches whoever sends on the same device next.
+        """
+        expired = []
+        with self._lock:
+            while True:
+                now = perf_counter_ns()
+                expired += self._expire(timeout_ns, now)
+                self._forget_evicted(now)
+                deadlines = []
+                if self._open:
+                    deadlines.append(next(iter(self._open.values())) + timeout_ns)
+                if self._evicted:
+                    deadlines.append(next(iter(self._evicted.values()))[1] + self.late_grace_ns)
+                if not deadlines:
+                    return expired
+                self._changed.wait(max(0, min(deadlines) - now + 1) / 1_000_000_000)
+
+    def wait_for_slot(self, window_size: int, timeout_ns: int) -> bool:
+        """Block until fewer than window_size frames are open.
+
+        Returns False early when the oldest open frame reaches its deadline
+        or when wake() is called, so the caller can expire frames or stop.
+        """
+        with self._lock:
+            while len(self._open) >= window_size and not self._woken:
+                oldest_ns = next(iter(self._open.values()))
+                remaining_ns = oldest_ns + timeout_ns - perf_counter_ns()
+                if remaining_ns <= 0:
+                    return False
+                self._changed.wait(remaining_ns / 1_000_000_000)
+            return not self._woken
+
+    def wake(self):
+        with self._lock:
+            self._woken = True
+            self._changed.notify_all()
+
+    def _expire(self, timeout_ns: int, now: int) -> List[int]:
+        expired = []
+        while self._open:
+            frame_id, sent_ns = next(iter(self._open.items()))
+            if now - sent_ns <= timeout_ns:
+                break
+            del self._open[frame_id]
+            self._evicted[frame_id] = (sent_ns, now)
+            expired.append(frame_id)
+        return expired
+
+    def _forget_evicted(self, now: int):
+        while self._evicted:
+            _, (_, evicted_ns) = next(iter(self._evicted.items()))
+            if now - evicted_ns <= self.late_grace_ns:
+                break
+            self._evicted.popitem(last=False)
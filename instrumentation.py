@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import json
+import signal
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Dict, Optional, Union
+
+from online_stats import LogHistogram, RunningStats
+
+# Send path: enqueue (from the send call until the writer thread has encoded
+# the batch holding the command), write (serial.write), flush (serial.flush).
+# Receive path: read (serial read call for bytes already buffered; reads that
+# had to wait for data are not counted, that wait is link time), decode
+# (splitting and parsing the chunk), log (log sink and history listeners)
+# and dispatch (listener callbacks), the last two per event.
+STAGES = ("enqueue", "write", "flush", "read", "decode", "log", "dispatch")
+
+
+class Instrumentation:
+	"""Per-stage timing histograms for DeviceClient's hot path.
+
+	Pass an instance as DeviceClient(instrumentation=...); without one the
+	client only pays an `is None` check per stage.
+	"""
+
+	def __init__(self):
+		self._lock = Lock()
+		self.reset()
+
+	def reset(self):
+		with self._lock:
+			self._histograms = {stage: LogHistogram() for stage in STAGES}
+			self._stats = {stage: RunningStats() for stage in STAGES}
+			self.started = time()
+
+	def record(self, stage: str, duration_ns: int):
+		duration_us = duration_ns / 1000
+		with self._lock:
+			self._histograms[stage].add(duration_us)
+			self._stats[stage].add(duration_us)
+
+	def snapshot(self) -> Dict[str, Dict[str, float]]:
+		with self._lock:
+			snapshot = {}
+			for stage in STAGES:
+				stats = self._stats[stage]
+				if not stats.count:
+					continue
+				percentiles = self._histograms[stage].percentiles((50, 90, 99))
+				snapshot[stage] = {
+					"count": stats.count,
+					"mean_us": stats.mean,
+					"p50_us": percentiles[50],
+					"p90_us": percentiles[90],
+					"p99_us": percentiles[99],
+					"max_us": stats.max,
+				}
+			return snapshot
+
+	def dump(self, path: Optional[Union[str, Path]] = None) -> str:
+		"""Return the snapshot as JSON, also writing it to path if given."""
+		text = json.dumps({"since": self.started, "stages": self.snapshot()}, indent=2)
+		if path is not None:
+			Path(path).write_text(text)
+		return text
+
+	def dump_on_signal(self, path: Union[str, Path], signum: int = getattr(signal, "SIGUSR1", signal.SIGINT)):
+		"""Write a snapshot to path whenever the process receives signum (SIGUSR1 by default)."""
+		signal.signal(signum, lambda *_: self.dump(path))
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+from queue import Empty, SimpleQueue
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from typing import Dict, List, Optional, Tuple, Union
+
+
+_STOP = object()
+
+# Where clients log when they are not given a sink.
+DEFAULT_PATH = Path(__file__).with_name("log.txt")
+
+
+class LogSink:
+	"""Appends device traffic to a log file from a background thread.
+
+	log() only timestamps the line and puts it on a queue; formatting,
+	writing and flushing happen in batches on the sink's own thread, at
+	most every flush_interval seconds. The file is rotated to
+	log.txt.1 ... log.txt.<backup_count> once it grows past max_bytes.
+	"""
+
+	def __init__(
+		self,
+		path: Union[str, Path],
+		flush_interval: float = 0.5,
+		max_bytes: int = 10 * 1024 * 1024,
+		backup_count: int = 3,
+		max_batch: int = 4096,
+	):
+		self.path = Path(path)
+		self.flush_interval = flush_interval
+		self.max_bytes = max_bytes
+		self.backup_count = backup_count
+		self.max_batch = max_batch
+
+		self._queue: SimpleQueue = SimpleQueue()
+		self._handle = None
+		self._closed = False
+		self._thread = Thread(target=self._run, name=f"log-sink:{self.path.name}", daemon=True)
+		self._thread.start()
+
+	def log(self, direction: str, payload: str, tag: Optional[str] = None):
+		if not self._closed:
+			self._queue.put((time(), direction, payload, tag))
+
+	def tagged(self, tag: str) -> "TaggedLogSink":
+		"""A view of this sink that marks every line with tag, e.g. the serial port."""
+		return TaggedLogSink(self, tag)
+
+	def flush(self, timeout: Optional[float] = None) -> bool:
+		"""Block until everything logged so far is on disk."""
+		if self._closed:
+			return True
+		done = Event()
+		self._queue.put(done)
+		return done.wait(timeout)
+
+	def close(self, timeout: Optional[float] = 2.0):
+		if self._closed:
+			return
+		self._closed = True
+		self._queue.put(_STOP)
+		self._thread.join(timeout)
+
+	def _run(self):
+		pending: List[str] = []
+		next_flush = monotonic() + self.flush_interval
+		while True:
+			try:
+				item = self._queue.get(timeout=max(0.0, next_flush - monotonic()))
+			except Empty:
+				item = None
+			if item is _STOP:
+				break
+			if isinstance(item, Event):
+				self._write(pending)
+				item.set()
+				next_flush = monotonic() + self.flush_interval
+				continue
+			if item is not None:
+				pending.append(self._format(*item))
+			if len(pending) >= self.max_batch or monotonic() >= next_flush:
+				self._write(pending)
+				next_flush = monotonic() + self.flush_interval
+		self._write(pending)
+		if self._handle:
+			self._handle.close()
+			self._handle = None
+
+	@staticmethod
+	def _format(timestamp: float, direction: str, payload: str, tag: Optional[str]) -> str:
+		clock = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+		line = f"[{clock}] [{tag}] [{direction}]: {payload}" if tag else f"[{clock}] [{direction}]: {payload}"
+		return line.replace("\0", "<NUL>") + "\n"
+
+	def _write(self, pending: List[str]):
+		if not pending:
+			return
+		try:
+			if self._handle is None:
+				self._handle = self.path.open("a", encoding="ascii", errors="replace")
+			self._handle.write("".join(pending))
+			self._handle.flush()
+			if self.max_bytes and self._handle.tell() >= self.max_bytes:
+				self._rotate()
+		except OSError:
+			pass
+		pending.clear()
+
+	def _rotate(self):
+		self._handle.close()
+		self._handle = None
+		if self.backup_count <= 0:
+			self.path.unlink(missing_ok=True)
+			return
+		for index in range(self.backup_count - 1, 0, -1):
+			source = self.path.with_name(f"{self.path.name}.{index}")
+			if source.exists():
+				source.replace(self.path.with_name(f"{self.path.name}.{index + 1}"))
+		self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+
+
+# One sink per file for the whole process: two sinks on the same file would
+# each rotate it, and one would go on writing to the renamed file.
+_shared: Dict[Path, Tuple[LogSink, int]] = {}
+_shared_lock = Lock()
+
+
+def open_shared(path: Union[str, Path] = DEFAULT_PATH) -> LogSink:
+	"""The process-wide sink for path; give it back with release_shared() instead of closing it."""
+	path = Path(path).resolve()
+	with _shared_lock:
+		sink, users = _shared.get(path, (None, 0))
+		if sink is None:
+			sink = LogSink(path)
+		_shared[path] = (sink, users + 1)
+		return sink
+
+
+def release_shared(sink: LogSink):
+	"""Close the shared sink once its last user has released it."""
+	with _shared_lock:
+		_, users = _shared.get(sink.path, (sink, 1))
+		if users > 1:
+			_shared[sink.path] = (sink, users - 1)
+			return
+		_shared.pop(sink.path, None)
+	sink.close()
+
+
+class TaggedLogSink:
+	"""Writes to a shared LogSink with a fixed tag; closing it leaves the sink open."""
+
+	def __init__(self, sink: LogSink, tag: str):
+		self.sink = sink
+		self.tag = tag
+
+	def log(self, direction: str, payload: str):
+		self.sink.log(direction, payload, self.tag)
+
+	def flush(self, timeout: Optional[float] = None) -> bool:
+		return self.sink.flush(timeout)
+
+	def close(self, timeout: Optional[float] = 2.0):
+		pass
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from math import frexp, ldexp, nan, sqrt
+from threading import Lock
+from typing import Dict, Iterable
+
+
+class RunningStats:
+    """Welford's online mean and variance."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = nan
+        self.max = nan
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.count == 1:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / (self.count - 1) if self.count > 1 else nan
+
+    @property
+    def stddev(self) -> float:
+        return sqrt(self.variance) if self.count > 1 else nan
+
+
+class LogHistogram:
+    """Log-linear histogram in the style of HdrHistogram.
+
+    Every power of two is split into `sub_buckets` linear buckets, so a
+    percentile is reported within a relative error of 1 / sub_buckets no
+    matter how wide the range of recorded values is.
+    """
+
+    def __init__(self, sub_buckets: int = 128):
+        self.sub_buckets = sub_buckets
+        self.count = 0
+        self._non_positive = 0
+        self._buckets: Dict[int, int] = {}
+
+    def add(self, value: float):
+        self.count += 1
+        if value <= 0:
+            self._non_positive += 1
+            return
+        mantissa, exponent = frexp(value)
+        index = exponent * self.sub_buckets + int((mantissa - 0.5) * 2 * self.sub_buckets)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+
+    def percentile(self, percent: float) -> float:
+        if not self.count:
+            return nan
+        rank = max(1, round(percent / 100 * self.count))
+        seen = self._non_positive
+        if seen >= rank:
+            return 0.0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                return self._bucket_midpoint(index)
+        return self._bucket_midpoint(max(self._buckets))
+
+    def percentiles(self, percents: Iterable[float]) -> Dict[float, float]:
+        return {percent: self.percentile(percent) for percent in percents}
+
+    def _bucket_midpoint(self, index: int) -> float:
+        exponent, sub = divmod(index, self.sub_buckets)
+        return ldexp(0.5 + (sub + 0.5) / (2 * self.sub_buckets), exponent)
+
+
+class RunStatistics:
+    """Live RTT and loss accounting for one experiment run."""
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.rtt = RunningStats()
+            self.histogram = LogHistogram()
+            self.sent = 0
+            self.timeouts = 0
+            self.late = 0
+            self.duplicates = 0
+
+    def record_sent(self):
+        with self._lock:
+            self.sent += 1
+
+    def record_rtt(self, rtt_ms: float):
+        with self._lock:
+            self.rtt.add(rtt_ms)
+            self.histogram.add(rtt_ms)
+
+    def record_timeouts(self, count: int = 1):
+        with self._lock:
+            self.timeouts += count
+
+    def record_late(self):
+        with self._lock:
+            self.late += 1
+
+    def record_duplicate(self):
+        with self._lock:
+            self.duplicates += 1
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            finished = self.rtt.count + self.timeouts
+            summary = {
+                "sent": self.sent,
+                "acked": self.rtt.count,
+                "timeouts": self.timeouts,
+                "late": self.late,
+                "duplicates": self.duplicates,
+                "loss_rate": self.timeouts / finished if finished else nan,
+                "rtt_mean_ms": self.rtt.mean if self.rtt.count else nan,
+                "rtt_stddev_ms": self.rtt.stddev,
+                "rtt_min_ms": self.rtt.min,
+                "rtt_max_ms": self.rtt.max,
+            }
+            for percent, value in self.histogram.percentiles(self.PERCENTILES).items():
+                summary[f"rtt_p{percent}_ms"] = value
+        return summary
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Condition, Lock
+from time import perf_counter_ns
+from typing import Deque, Dict, Iterator, List, NamedTuple, Optional
+
+from device_client import DeviceClient
+from log_sink import LogSink, open_shared, release_shared
+from protocol import Ack, Config, Data, DeviceEvent
+
+
+class OrchestratorEvent(NamedTuple):
+	timestamp_ns: int
+	port: str
+	message: str
+	event: DeviceEvent
+
+
+class DeviceStats:
+
+	def __init__(self):
+		self.frames_sent = 0
+		self.bytes_sent = 0
+		self.acks = 0
+		self.frames_received = 0
+		self.bytes_received = 0
+
+	def as_dict(self, elapsed_s: float) -> Dict[str, float]:
+		elapsed_s = max(elapsed_s, 1e-9)
+		return {
+			"frames_sent": self.frames_sent,
+			"bytes_sent": self.bytes_sent,
+			"acks": self.acks,
+			"frames_received": self.frames_received,
+			"bytes_received": self.bytes_received,
+			"sent_frames_per_s": self.frames_sent / elapsed_s,
+			"sent_bytes_per_s": self.bytes_sent / elapsed_s,
+			"acks_per_s": self.acks / elapsed_s,
+			"received_bytes_per_s": self.bytes_received / elapsed_s,
+		}
+
+
+class DeviceOrchestrator:
+	"""Drives one DeviceClient per serial port from a single process.
+
+	Ports are opened in parallel, commands can be fanned out to every
+	device at once, and the lines all devices report are merged into one
+	timestamped stream read with events(). That stream keeps the newest
+	max_events events; older ones are dropped if nobody reads them. Every
+	device logs to the shared sink with its port as tag.
+	"""
+
+	MAX_EVENTS = 10000
+
+	def __init__(self, ports: List[str], baudrate: int = 115200, log_sink: Optional[LogSink] = None, max_events: int = MAX_EVENTS):
+		self.ports = list(ports)
+		self._owns_log_sink = log_sink is None
+		self._log_sink = log_sink if log_sink is not None else open_shared()
+		self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.ports)))
+		self._events: Deque[OrchestratorEvent] = deque(maxlen=max_events)
+		self._events_ready = Condition()
+		self._stats: Dict[str, DeviceStats] = {port: DeviceStats() for port in self.ports}
+		self._stats_lock = Lock()
+		self.clients: Dict[str, DeviceClient] = {}
+
+		futures = {port: self._executor.submit(DeviceClient, port=port, baudrate=baudrate, log_sink=self._log_sink.tagged(port)) for port in self.ports}
+		error: Optional[BaseException] = None
+		for port, future in futures.items():
+			try:
+				self.clients[port] = future.result()
+			except Exception as exc:
+				error = error or exc
+		if error is not None:
+			self.close()
+			raise error
+
+		for port, client in self.clients.items():
+			client.add_listener(partial(self._on_message, port))
+			client.add_history_listeners(partial(self._on_history, port))
+		self._started_ns = perf_counter_ns()
+
+	def close(self):
+		for client in self.clients.values():
+			client.close()
+		self.clients.clear()
+		self._executor.shutdown(wait=False)
+		if self._owns_log_sink:
+			release_shared(self._log_sink)
+			self._owns_log_sink = False
+
+	def __enter__(self) -> "DeviceOrchestrator":
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def client(self, port: str) -> DeviceClient:
+		return self.clients[port]
+
+	def broadcast(self, method: str, *args, ports: Optional[List[str]] = None) -> Dict[str, object]:
+		"""Call a DeviceClient method on several devices concurrently."""
+		targets = self.ports if ports is None else ports
+		futures = {port: self._executor.submit(getattr(self.clients[port], method), *args) for port in targets}
+		return {port: future.result() for port, future in futures.items()}
+
+	def send_text(self, port: str, message: str, destination: str):
+		self._executor.submit(self.clients[port].send_text, message, destination).result()
+
+	def configure_all(self, group: int, parameter: int, value: int, timeout: float = DeviceClient.COMMAND_TIMEOUT) -> Dict[str, Config]:
+		"""Configure every device and wait for all confirmations; raises TimeoutError if one is missing."""
+		futures = self.broadcast("configure", group, parameter, value, timeout)
+		return {port: future.result() for port, future in futures.items()}
+
+	def events(self, timeout: Optional[float] = None) -> Iterator[OrchestratorEvent]:
+		"""Yield events from all devices in arrival order until timeout passes without one."""
+		while True:
+			with self._events_ready:
+				if not self._events_ready.wait_for(lambda: self._events, timeout):
+					return
+				event = self._events.popleft()
+			yield event
+
+	def reset_stats(self):
+		with self._stats_lock:
+			self._stats = {port: DeviceStats() for port in self.ports}
+			self._started_ns = perf_counter_ns()
+
+	def throughput(self) -> Dict[str, Dict[str, float]]:
+		with self._stats_lock:
+			elapsed_s = (perf_counter_ns() - self._started_ns) / 1_000_000_000
+			return {port: stats.as_dict(elapsed_s) for port, stats in self._stats.items()}
+
+	def _on_message(self, port: str, event: DeviceEvent):
+		with self._events_ready:
+			self._events.append(OrchestratorEvent(perf_counter_ns(), port, event.raw, event))
+			self._events_ready.notify()
+		if not isinstance(event, (Ack, Data)):
+			return
+		with self._stats_lock:
+			stats = self._stats[port]
+			if isinstance(event, Ack):
+				stats.acks += 1
+			else:
+				stats.frames_received += 1
+				stats.bytes_received += len(event.payload)
+
+	def _on_history(self, port: str, direction: str, payload: str):
+		if direction != "to device" or not payload.startswith("m["):
+			return
+		message_length = payload.find("\0")
+		with self._stats_lock:
+			stats = self._stats[port]
+			stats.frames_sent += 1
+			stats.bytes_sent += message_length - 2 if message_length >= 0 else len(payload) - 2
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import lzma
+import zlib
+from base64 import b85decode, b85encode
+from threading import Lock
+from typing import Dict, Optional
+
+# A binary payload travels as MARKER, a mode character and the encoded
+# bytes. Both encodings only produce printable ASCII without ',' so the
+# frame survives the ASCII line protocol and the firmware's NUL terminator.
+MARKER = "\x02"
+ESCAPED = "e"
+BASE85 = "z"
+# A compressed frame payload is MARKER, a compression flag and the encoded
+# compressed bytes of the original payload (text, binary or fragment).
+ZLIB = "Z"
+LZMA = "X"
+
+# Shorter payloads never shrink; lzma only beats deflate on longer ones.
+MIN_COMPRESS = 24
+MIN_LZMA = 256
+_LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 9}]
+
+_ESCAPE = ord("=")
+# Printable ASCII passes through unchanged; everything else, and '=' and ','
+# themselves, becomes '=' plus two hex digits.
+_PLAIN = bytes(byte for byte in range(0x20, 0x7F) if byte not in (_ESCAPE, ord(",")))
+_ESCAPE_TABLE = [chr(byte) if byte in _PLAIN else f"={byte:02X}" for byte in range(256)]
+
+
+def encoded_length(data: bytes, mode: str) -> int:
+	"""Length of encode(data, mode), mode character included, without encoding."""
+	if mode == BASE85:
+		full, rest = divmod(len(data), 4)
+		return 1 + full * 5 + (rest + 1 if rest else 0)
+	# translate() with a delete table leaves only the bytes that need escaping.
+	return 1 + len(data) + 2 * len(data.translate(None, _PLAIN))
+
+
+def choose_mode(data: bytes) -> str:
+	"""Pick the shorter encoding: escaping for mostly printable data, base85 otherwise."""
+	return ESCAPED if encoded_length(data, ESCAPED) <= encoded_length(data, BASE85) else BASE85
+
+
+def encode(data: bytes, mode: Optional[str] = None) -> str:
+	"""Encode bytes as mode character plus body, picking the mode if none is given."""
+	mode = mode or choose_mode(data)
+	if mode == BASE85:
+		return BASE85 + b85encode(data).decode("ascii")
+	if mode == ESCAPED:
+		return ESCAPED + "".join(map(_ESCAPE_TABLE.__getitem__, data))
+	raise ValueError(f"unknown payload mode {mode!r}")
+
+
+def decode(text: str) -> bytes:
+	"""Inverse of encode(); raises ValueError on malformed input."""
+	mode, body = text[:1], text[1:]
+	if mode == BASE85:
+		return b85decode(body)
+	if mode == ESCAPED:
+		raw = body.encode("ascii")
+		if b"=" not in raw:
+			return raw
+		out = bytearray()
+		start = 0
+		while True:
+			index = raw.find(b"=", start)
+			if index < 0:
+				out += raw[start:]
+				return bytes(out)
+			out += raw[start:index]
+			if index + 3 > len(raw):
+				raise ValueError("truncated escape sequence")
+			out.append(int(raw[index + 1:index + 3], 16))
+			start = index + 3
+	raise ValueError(f"unknown payload mode {mode!r}")
+
+
+def encode_payload(data: bytes, mode: Optional[str] = None) -> str:
+	return MARKER + encode(data, mode)
+
+
+def decode_payload(payload: str) -> Optional[bytes]:
+	"""Bytes carried by a received payload, or None if it is plain text or malformed."""
+	if not payload.startswith(MARKER):
+		return None
+	try:
+		return decode(payload[1:])
+	except ValueError:
+		return None
+
+
+def _deflate(data: bytes) -> bytes:
+	# Raw deflate: the zlib header and checksum would cost 6 bytes per frame.
+	compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+	return compressor.compress(data) + compressor.flush()
+
+
+_DECOMPRESSORS = {
+	ZLIB: lambda data: zlib.decompress(data, -15),
+	LZMA: lambda data: lzma.decompress(data, lzma.FORMAT_RAW, filters=_LZMA_FILTERS),
+}
+
+
+def compress_payload(payload: str) -> str:
+	"""Return payload compressed with zlib or lzma, or unchanged if that is not shorter."""
+	if len(payload) < MIN_COMPRESS:
+		return payload
+	data = payload.encode("ascii", errors="replace")
+	best = payload
+	candidates = [(ZLIB, _deflate(data))]
+	if len(data) >= MIN_LZMA:
+		candidates.append((LZMA, lzma.compress(data, lzma.FORMAT_RAW, filters=_LZMA_FILTERS)))
+	for flag, compressed in candidates:
+		if encoded_length(compressed, BASE85) + 2 >= len(best):
+			continue
+		encoded = MARKER + flag + encode(compressed)
+		if len(encoded) < len(best):
+			best = encoded
+	return best
+
+
+def expand_payload(payload: str) -> str:
+	"""Undo compress_payload(); any other payload is returned as it is."""
+	if payload[:1] != MARKER:
+		return payload
+	decompress = _DECOMPRESSORS.get(payload[1:2])
+	if decompress is None:
+		return payload
+	try:
+		return decompress(decode(payload[2:])).decode("ascii", errors="replace")
+	except (ValueError, zlib.error, lzma.LZMAError):
+		return payload
+
+
+class CompressionStats:
+	"""What compress_payload() saved on the frames a client sent."""
+
+	def __init__(self):
+		self._lock = Lock()
+		self.messages = 0
+		self.compressed = 0
+		self.original_bytes = 0
+		self.sent_bytes = 0
+
+	def record(self, original: int, sent: int):
+		with self._lock:
+			self.messages += 1
+			self.original_bytes += original
+			self.sent_bytes += sent
+			if sent < original:
+				self.compressed += 1
+
+	@property
+	def saved_bytes(self) -> int:
+		return self.original_bytes - self.sent_bytes
+
+	def as_dict(self) -> Dict[str, float]:
+		with self._lock:
+			return {
+				"messages": self.messages,
+				"compressed": self.compressed,
+				"original_bytes": self.original_bytes,
+				"sent_bytes": self.sent_bytes,
+				"saved_bytes": self.original_bytes - self.sent_bytes,
+				"saved_fraction": (self.original_bytes - self.sent_bytes) / self.original_bytes if self.original_bytes else 0.0,
+			}
@@ -0,0 +1,151 @@
+import json
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from protocol import Config, Reset
+
+GROUPS = ("PHY", "MAC", "LOG")
+
+# (name, description) of every parameter, indexed by configuration group and parameter number.
+PARAMETER_TABLE = [
+    [
+        ("preamble_length", "PHY preamble length"),
+        ("fec_threshold", "FEC threshold (default: disabled)"),
+        ("channel_busy_threshold", "Channel busy threshold (default: 20)"),
+        ("light_emission", "light emission (enable/disable)"),
+    ],
+    [
+        ("retransmissions", "# of re-transmissions"),
+        ("difs", "DIFS"),
+        ("cw_min", "CWmin (use power of two)"),
+        ("cw_max", "CWmax (use power of two)"),
+        ("rts_threshold", "RTS threshold (default: disabled)"),
+        ("address", "MAC address"),
+    ],
+    [
+        ("level", "logging level (0: none, 7: silly)"),
+        ("prefix", "logger prefix character (default: disabled)"),
+    ],
+]
+
+# "phy.fec_threshold" -> (0, 1)
+PARAMETERS: Dict[str, Tuple[int, int]] = {
+    f"{GROUPS[group].lower()}.{name}": (group, parameter)
+    for group, entries in enumerate(PARAMETER_TABLE)
+    for parameter, (name, _) in enumerate(entries)
+}
+_NAMES = {location: name for name, location in PARAMETERS.items()}
+
+PROFILES_PATH = Path(__file__).with_name("profiles.json")
+
+
+def parameter_name(group: int, parameter: int) -> str:
+    try:
+        return _NAMES[(group, parameter)]
+    except KeyError:
+        raise ValueError(f"no parameter {parameter} in configuration group {group}") from None
+
+
+class Profile:
+    """A named set of device parameter values, keyed by names from PARAMETERS."""
+
+    def __init__(self, name: str, settings: Dict[str, int]):
+        unknown = [key for key in settings if key not in PARAMETERS]
+        if unknown:
+            raise ValueError(f"unknown parameters in profile {name!r}: {', '.join(unknown)}")
+        self.name = name
+        self.settings = {key: int(value) for key, value in settings.items()}
+
+    @classmethod
+    def from_commands(cls, name: str, commands: Iterable[Tuple[int, int, int]]) -> "Profile":
+        return cls(name, {parameter_name(int(group), int(parameter)): int(value) for group, parameter, value in commands})
+
+    def merged(self, overrides: Dict[str, int], name: Optional[str] = None) -> "Profile":
+        return Profile(name or self.name, {**self.settings, **overrides})
+
+    def commands(self) -> List[Tuple[int, int, int]]:
+        return [(*PARAMETERS[key], value) for key, value in self.settings.items()]
+
+    def __repr__(self) -> str:
+        return f"Profile({self.name!r}, {self.settings!r})"
+
+
+# The values ExperimentUI starts with.
+DEFAULT_PROFILES = {
+    "experiment": Profile("experiment", {"phy.channel_busy_threshold": 20, "phy.fec_threshold": 0}),
+}
+
+
+def load_profiles(path: Union[str, Path] = PROFILES_PATH) -> Dict[str, Profile]:
+    """DEFAULT_PROFILES plus the profiles in a JSON file of {name: {parameter: value}}, if it exists."""
+    profiles = dict(DEFAULT_PROFILES)
+    path = Path(path)
+    if path.is_file():
+        for name, settings in json.loads(path.read_text()).items():
+            profiles[name] = Profile(name, settings)
+    return profiles
+
+
+def get_profile(name: str, path: Union[str, Path] = PROFILES_PATH) -> Profile:
+    profiles = load_profiles(path)
+    if name not in profiles:
+        raise KeyError(f"unknown profile {name!r}, known: {', '.join(sorted(profiles))}")
+    return profiles[name]
+
+
+class DeviceConfiguration:
+    """Cached view of one device's settings with a diff-based apply().
+
+    The cache follows every c[...] echo the device sends, whoever caused
+    it, and is dropped when the device reports a reset. Parameters never
+    seen since then count as unknown, so the first apply() sends all of a
+    profile and later ones only what differs.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._current: Dict[Tuple[int, int], int] = {}
+        self._lock = Lock()
+        client.add_listener(self._on_event, Config, Reset)
+
+    def close(self):
+        self.client.remove_listener(self._on_event)
+
+    @property
+    def current(self) -> Dict[str, int]:
+        with self._lock:
+            return {parameter_name(*location): value for location, value in self._current.items() if location in _NAMES}
+
+    def invalidate(self):
+        with self._lock:
+            self._current.clear()
+
+    def diff(self, profile: Profile) -> List[Tuple[int, int, int]]:
+        with self._lock:
+            return [(group, parameter, value) for group, parameter, value in profile.commands() if self._current.get((group, parameter)) != value]
+
+    def apply(self, profile: Profile, timeout: Optional[float] = None) -> List[Config]:
+        """Send the parameters that differ in one batch and wait until each is confirmed.
+
+        Returns the device's answers (empty if nothing changed); raises
+        TimeoutError like DeviceClient.configure_many.
+        """
+        changes = self.diff(profile)
+        if not changes:
+            return []
+        if timeout is None:
+            responses = self.client.configure_many(changes)
+        else:
+            responses = self.client.configure_many(changes, timeout)
+        with self._lock:
+            for response in responses:
+                self._current[(response.group, response.parameter)] = response.value
+        return responses
+
+    def _on_event(self, event):
+        with self._lock:
+            if isinstance(event, Reset):
+                self._current.clear()
+            elif event.group is not None:
+                self._current[(event.group, event.parameter)] = event.value
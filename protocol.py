@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+from collections import deque
+from threading import Lock
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+
+from payload_codec import MARKER, expand_payload
+
+
+class DeviceEvent:
+	"""One line reported by the device, parsed once by FrameParser.
+
+	`raw` keeps the line as received (without the newline) for logs and
+	history; the subclasses add the fields of their line type. Events are
+	shared between listeners and must be treated as read-only.
+	"""
+
+	__slots__ = ("raw",)
+
+	def __init__(self, raw: str):
+		self.raw = raw
+
+	def __str__(self) -> str:
+		return self.raw
+
+	def __repr__(self) -> str:
+		return f"{type(self).__name__}({self.raw!r})"
+
+
+class Ack(DeviceEvent):
+	"""m[R,A]: the last data frame was acknowledged."""
+
+	__slots__ = ()
+
+
+class Data(DeviceEvent):
+	"""m[R,D,payload]: a frame received from another device.
+
+	A payload the sender compressed (payload_codec.compress_payload) is
+	expanded here, so listeners always see the payload as it was sent.
+	"""
+
+	__slots__ = ("payload",)
+
+	def __init__(self, raw: str, payload: str):
+		self.raw = raw
+		self.payload = expand_payload(payload) if payload[:1] == MARKER else payload
+
+
+class Config(DeviceEvent):
+	"""c[group,parameter,value]; the fields are None if the line did not parse."""
+
+	__slots__ = ("group", "parameter", "value")
+
+	def __init__(self, raw: str, group: Optional[int], parameter: Optional[int], value: Optional[int]):
+		self.raw = raw
+		self.group = group
+		self.parameter = parameter
+		self.value = value
+
+
+class Address(DeviceEvent):
+	__slots__ = ("address",)
+
+	def __init__(self, raw: str, address: str):
+		self.raw = raw
+		self.address = address
+
+
+class Version(DeviceEvent):
+	__slots__ = ("version",)
+
+	def __init__(self, raw: str, version: str):
+		self.raw = raw
+		self.version = version
+
+
+class Reset(DeviceEvent):
+	__slots__ = ()
+
+
+class Unknown(DeviceEvent):
+	"""Any other line, e.g. firmware log output or an m[...] we do not know."""
+
+	__slots__ = ()
+
+
+# Host -> device commands. The templates are bound once so encoding a
+# frame is a single format call.
+RESET = "r"
+REQUEST_VERSION = "p"
+REQUEST_ADDRESS = "a"
+encode_text: Callable[[str, str], str] = "m[{}\0,{}]".format
+encode_config: Callable[[int, int, int], str] = "c[{},{},{}]".format
+encode_set_address: Callable[[str], str] = "a[{}]".format
+
+
+_ACK_LINE = "m[R,A]"
+_DATA_PREFIX = "m[R,D,"
+# Every ACK line is identical, so one shared event serves them all.
+ACK = Ack(_ACK_LINE)
+
+
+def _body(text: str) -> str:
+	return text[2:-1] if text.endswith("]") else text[2:]
+
+
+def _parse_message(text: str) -> DeviceEvent:
+	if text == _ACK_LINE:
+		return ACK
+	if text.startswith(_DATA_PREFIX):
+		return Data(text, text[6:-1] if text[-1] == "]" else text[6:])
+	return Unknown(text)
+
+
+def _parse_config(text: str) -> Config:
+	parts = _body(text).split(",")
+	try:
+		group, parameter, value = (int(part.strip(), 0) for part in parts)
+	except ValueError:
+		return Config(text, None, None, None)
+	return Config(text, group, parameter, value)
+
+
+_DECODERS: Dict[str, Callable[[str], DeviceEvent]] = {
+	"m[": _parse_message,
+	"c[": _parse_config,
+	"a[": lambda text: Address(text, _body(text)),
+	"p[": lambda text: Version(text, _body(text)),
+}
+
+
+def parse_line(text: str) -> DeviceEvent:
+	"""Turn one stripped line from the device into its event."""
+	decoder = _DECODERS.get(text[:2])
+	if decoder is not None:
+		return decoder(text)
+	if text == RESET:
+		return Reset(text)
+	return Unknown(text)
+
+
+class EventDispatcher:
+	"""Listener registry that routes each event by its type.
+
+	A listener added without event types gets every event; one added with
+	types only sees those, so an ACK-only consumer is never called for the
+	other lines. The lists are replaced rather than mutated, so listeners
+	can be added or removed while another thread is emitting.
+	"""
+
+	def __init__(self):
+		self._all: List[Callable[[DeviceEvent]]] = []
+		self._by_type: Dict[type, List[Callable[[DeviceEvent]]]] = {}
+
+	def add(self, callback: Callable[[DeviceEvent]], event_types: Iterable[type] = ()):
+		event_types = tuple(event_types)
+		if not event_types or DeviceEvent in event_types:
+			self._all = self._all + [callback]
+			return
+		by_type = dict(self._by_type)
+		for event_type in event_types:
+			by_type[event_type] = by_type.get(event_type, []) + [callback]
+		self._by_type = by_type
+
+	def remove(self, callback: Callable[[DeviceEvent]]):
+		self._all = [listener for listener in self._all if listener != callback]
+		self._by_type = {
+			event_type: [listener for listener in listeners if listener != callback]
+			for event_type, listeners in self._by_type.items()
+		}
+
+	def emit(self, event: DeviceEvent):
+		for callback in self._all:
+			callback(event)
+		typed = self._by_type.get(type(event))
+		if typed:
+			for callback in typed:
+				callback(event)
+
+
+# Keys that pair a command with the line the device answers it with.
+RESET_KEY = ("r",)
+VERSION_KEY = ("p",)
+ADDRESS_KEY = ("a",)
+
+
+def config_key(group, parameter) -> tuple:
+	return ("c", int(str(group), 0), int(str(parameter), 0))
+
+
+def response_key(event: DeviceEvent) -> Optional[tuple]:
+	if isinstance(event, Config):
+		return None if event.group is None else ("c", event.group, event.parameter)
+	if isinstance(event, Address):
+		return ADDRESS_KEY
+	if isinstance(event, Version):
+		return VERSION_KEY
+	if isinstance(event, Reset):
+		return RESET_KEY
+	return None
+
+
+class ResponseTracker:
+	"""Futures waiting for the device's answer to a command.
+
+	Responses carry no request id, so futures with the same key are
+	resolved in the order they were registered, which is the order the
+	commands were written. Futures that are already done (timed out or
+	cancelled) are skipped. Works with concurrent.futures and asyncio
+	futures alike; asyncio ones must be resolved on their loop.
+	"""
+
+	RESPONSE_TYPES = (Config, Address, Version, Reset)
+
+	def __init__(self):
+		self._pending: Dict[tuple, Deque] = {}
+		self._lock = Lock()
+
+	def expect(self, key: tuple, future):
+		with self._lock:
+			self._pending.setdefault(key, deque()).append(future)
+
+	def resolve(self, event: DeviceEvent):
+		key = response_key(event)
+		future = None
+		with self._lock:
+			waiting = self._pending.get(key)
+			while waiting:
+				candidate = waiting.popleft()
+				if not candidate.done():
+					future = candidate
+					break
+		if future is not None:
+			future.set_result(event)
+
+	def expire(self, key: tuple, future, timeout: float):
+		with self._lock:
+			waiting = self._pending.get(key)
+			if waiting and future in waiting:
+				waiting.remove(future)
+		if not future.done():
+			future.set_exception(TimeoutError(f"no response to {key[0]} command within {timeout:g} s"))
+
+	def fail_all(self, error: BaseException):
+		with self._lock:
+			pending = [future for waiting in self._pending.values() for future in waiting]
+			self._pending.clear()
+		for future in pending:
+			if not future.done():
+				future.set_exception(error)
+
+
+class FrameParser:
+	"""Splits the device's byte stream into lines and parses each one.
+
+	feed() takes whatever the serial port returned, however it is chunked.
+	All complete lines are decoded in one go straight from the reused
+	buffer through a memoryview and then split; a trailing partial line
+	stays buffered for the next call. A partial line longer than max_line (a stream with
+	no newlines) is dropped.
+	"""
+
+	MAX_LINE = 64 * 1024
+
+	def __init__(self, max_line: int = MAX_LINE):
+		self.max_line = max_line
+		self._buffer = bytearray()
+
+	def feed(self, data: bytes) -> List[DeviceEvent]:
+		buffer = self._buffer
+		buffer += data
+		end = buffer.rfind(b"\n")
+		if end < 0:
+			if len(buffer) > self.max_line:
+				buffer.clear()
+			return []
+		with memoryview(buffer) as view:
+			text = str(view[:end], "ascii", "replace")
+		del buffer[:end + 1]
+		events = []
+		append = events.append
+		for line in text.split("\n"):
+			# ACKs and received data dominate the stream; skip strip() and the decoder table for them.
+			if line == _ACK_LINE:
+				append(ACK)
+				continue
+			if line[-1:] == "]" and line.startswith(_DATA_PREFIX):
+				append(Data(line, line[6:-1]))
+				continue
+			line = line.strip()
+			if line:
+				append(parse_line(line))
+		return events
+
+	def clear(self):
+		self._buffer.clear()
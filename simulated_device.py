@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import heapq
+import os
+import random
+import tty
+from itertools import count
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable, List, Optional, Union
+
+
+class SimulatedDevice:
+	"""Software stand-in for a VLC board speaking the serial line protocol.
+
+	Handles m[...], c[...], a, a[...], p and r like the firmware does and
+	answers data frames with m[R,A] after a delay drawn from `latency`.
+	Frames are transmitted one after another, so ACKs keep the send order.
+	Frames can be dropped (`loss_rate`, no ACK) and payloads delivered to a
+	connected peer as m[R,D,...] can have bits flipped (`bit_error_rate`).
+	Attach it to a DeviceClient with loopback() or serve_pty().
+	"""
+
+	VERSION = "sim-1.0"
+
+	def __init__(
+		self,
+		address: str = "00",
+		latency: Union[float, Callable[[], float]] = 0.0,
+		loss_rate: float = 0.0,
+		bit_error_rate: float = 0.0,
+		seed: Optional[int] = None,
+	):
+		self.address = address
+		self.latency = latency
+		self.loss_rate = loss_rate
+		self.bit_error_rate = bit_error_rate
+		self.config = {}
+		self.peers: List["SimulatedDevice"] = []
+		self.frames_sent = 0
+		self.frames_lost = 0
+
+		self._random = random.Random(seed)
+		self._outputs: List[Callable[[bytes], None]] = []
+		self._queue = []
+		self._sequence = count()
+		self._changed = Condition()
+		self._running = True
+		self._busy_until = 0.0
+		self._scheduler = Thread(target=self._run_scheduler, name="simulated-device", daemon=True)
+		self._scheduler.start()
+
+	def connect(self, peer: "SimulatedDevice"):
+		self.peers.append(peer)
+		peer.peers.append(self)
+
+	def add_output(self, callback: Callable[[bytes], None]):
+		self._outputs.append(callback)
+
+	def close(self):
+		with self._changed:
+			self._running = False
+			self._changed.notify_all()
+
+	def loopback(self, timeout: float = 1.0) -> "LoopbackSerial":
+		return LoopbackSerial(self, timeout)
+
+	def serve_pty(self) -> str:
+		"""Expose the device on a pseudo terminal and return the path to open."""
+		master, slave = os.openpty()
+		tty.setraw(slave)
+		self.add_output(lambda data: os.write(master, data))
+
+		def pump():
+			buffer = b""
+			while self._running:
+				try:
+					chunk = os.read(master, 4096)
+				except OSError:
+					return
+				if not chunk:
+					return
+				buffer += chunk
+				*lines, buffer = buffer.split(b"\n")
+				for line in lines:
+					self.handle_line(line.decode("ascii", errors="replace").strip())
+
+		Thread(target=pump, name="simulated-device-pty", daemon=True).start()
+		return os.ttyname(slave)
+
+	def handle_line(self, line: str):
+		if not line:
+			return
+		if line == "r":
+			self.config.clear()
+			self._emit("r")
+		elif line == "p":
+			self._emit(f"p[{self.VERSION}]")
+		elif line == "a":
+			self._emit(f"a[{self.address}]")
+		elif line.startswith("a[") and line.endswith("]"):
+			self.address = line[2:-1]
+			self._emit(f"a[{self.address}]")
+		elif line.startswith("c[") and line.endswith("]"):
+			try:
+				group, parameter, value = (int(part, 0) for part in line[2:-1].split(","))
+			except ValueError:
+				return
+			self.config[(group, parameter)] = value
+			self._emit(f"c[{group},{parameter},{value}]")
+		elif line.startswith("m[") and line.endswith("]"):
+			body = line[2:-1]
+			message, _, destination = body.rpartition(",")
+			self._transmit(message.rstrip("\0"), destination)
+
+	def _transmit(self, message: str, destination: str):
+		self.frames_sent += 1
+		delay = self.latency() if callable(self.latency) else self.latency
+		if self._random.random() < self.loss_rate:
+			self.frames_lost += 1
+			return
+		if delay <= 0:
+			self._deliver(message, destination)
+			return
+		with self._changed:
+			start = max(monotonic(), self._busy_until)
+			self._busy_until = start + delay
+		self._schedule(self._busy_until - monotonic(), self._deliver, message, destination)
+
+	def _deliver(self, message: str, destination: str):
+		for peer in self.peers:
+			if destination in (peer.address, "FF"):
+				peer._emit(f"m[R,D,{self._corrupt(message)}]")
+		self._emit("m[R,A]")
+
+	def _corrupt(self, message: str) -> str:
+		if not self.bit_error_rate:
+			return message
+		data = bytearray(message.encode("ascii", errors="replace"))
+		for index in range(len(data)):
+			for bit in range(7):
+				if self._random.random() < self.bit_error_rate:
+					data[index] ^= 1 << bit
+		# Keep the line framing intact, as the firmware would never emit these.
+		return data.decode("ascii").replace("\n", " ").replace("\0", " ")
+
+	def _emit(self, line: str):
+		data = f"{line}\n".encode("ascii", errors="replace")
+		for callback in self._outputs:
+			callback(data)
+
+	def _schedule(self, delay: float, callback, *args):
+		if delay <= 0:
+			callback(*args)
+			return
+		with self._changed:
+			heapq.heappush(self._queue, (monotonic() + delay, next(self._sequence), callback, args))
+			self._changed.notify()
+
+	def _run_scheduler(self):
+		while True:
+			with self._changed:
+				while self._running and (not self._queue or self._queue[0][0] > monotonic()):
+					self._changed.wait(self._queue[0][0] - monotonic() if self._queue else None)
+				if not self._running:
+					return
+				_, _, callback, args = heapq.heappop(self._queue)
+			callback(*args)
+
+
+class LoopbackSerial:
+	"""In-process replacement for serial.Serial wired to a SimulatedDevice."""
+
+	def __init__(self, device: SimulatedDevice, timeout: Optional[float] = 1.0):
+		self.device = device
+		self.timeout = timeout
+		self.is_open = True
+		self._rx = bytearray()
+		self._tx = bytearray()
+		self._readable = Condition()
+		device.add_output(self._receive)
+
+	def _receive(self, data: bytes):
+		with self._readable:
+			self._rx.extend(data)
+			self._readable.notify_all()
+
+	@property
+	def in_waiting(self) -> int:
+		return len(self._rx)
+
+	def write(self, data: bytes) -> int:
+		self._tx.extend(data)
+		*lines, rest = self._tx.split(b"\n")
+		self._tx = bytearray(rest)
+		for line in lines:
+			self.device.handle_line(line.decode("ascii", errors="replace").strip())
+		return len(data)
+
+	def flush(self):
+		pass
+
+	def read(self, size: int = 1) -> bytes:
+		with self._readable:
+			if not self._rx and self.is_open:
+				self._readable.wait(self.timeout)
+			data = bytes(self._rx[:size])
+			del self._rx[:size]
+			return data
+
+	def readline(self) -> bytes:
+		deadline = None if self.timeout is None else monotonic() + self.timeout
+		with self._readable:
+			while self.is_open:
+				end = self._rx.find(b"\n")
+				if end >= 0:
+					line = bytes(self._rx[:end + 1])
+					del self._rx[:end + 1]
+					return line
+				remaining = None if deadline is None else deadline - monotonic()
+				if remaining is not None and remaining <= 0:
+					break
+				self._readable.wait(remaining)
+			line = bytes(self._rx)
+			self._rx.clear()
+			return line
+
+	def close(self):
+		with self._readable:
+			self.is_open = False
+			self._readable.notify_all()
@@ -0,0 +1,165 @@
+import argparse
+import itertools
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from device_client import DeviceClient
+from experiment_session import WINDOW_WARNING, ExperimentSession
+from profiles import DeviceConfiguration, Profile, get_profile, parameter_name
+
+# Sweep axes that map onto a device configuration parameter (see profiles.PARAMETERS).
+CONFIG_AXES = {
+    "channel_busy_thresholds": "phy.channel_busy_threshold",
+    "fec_thresholds": "phy.fec_threshold",
+    "cw_min": "mac.cw_min",
+    "cw_max": "mac.cw_max",
+}
+AXIS_LABELS = {
+    "channel_busy_thresholds": "cbt",
+    "fec_thresholds": "fec",
+    "cw_min": "cwmin",
+    "cw_max": "cwmax",
+}
+
+
+class SweepSpec:
+    """Parameter sweep for unattended RTT measurements.
+
+    Every combination of payload_sizes and the configuration axes in
+    CONFIG_AXES is measured `repetitions` times; an axis left empty keeps
+    whatever the device is currently configured with. `profile` names a
+    profile (see profiles.load_profiles) applied underneath every point.
+    """
+
+    def __init__(
+        self,
+        port: str,
+        payload_sizes: List[int],
+        channel_busy_thresholds: Optional[List[int]] = None,
+        fec_thresholds: Optional[List[int]] = None,
+        cw_min: Optional[List[int]] = None,
+        cw_max: Optional[List[int]] = None,
+        repetitions: int = 1,
+        frames_per_run: int = 1000,
+        max_run_seconds: Optional[float] = None,
+        window_size: int = 1,
+        timeout: float = ExperimentSession.THRESHOLD_TIMEOUT,
+        destination: str = "00",
+        output_dir: str = "output/sweep",
+        profile: Optional[str] = None,
+    ):
+        self.port = port
+        self.payload_sizes = list(payload_sizes)
+        self.channel_busy_thresholds = list(channel_busy_thresholds or [])
+        self.fec_thresholds = list(fec_thresholds or [])
+        self.cw_min = list(cw_min or [])
+        self.cw_max = list(cw_max or [])
+        self.repetitions = repetitions
+        self.frames_per_run = frames_per_run
+        self.max_run_seconds = max_run_seconds
+        self.window_size = window_size
+        self.timeout = timeout
+        self.destination = destination
+        self.output_dir = Path(output_dir)
+        self.profile = profile
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SweepSpec":
+        return cls(**data)
+
+    @classmethod
+    def load(cls, path) -> "SweepSpec":
+        return cls.from_dict(json.loads(Path(path).read_text()))
+
+    def points(self) -> List[Dict[str, int]]:
+        # Configuration axes vary slowest so the device is reconfigured as rarely as possible.
+        axes = [(name, getattr(self, name)) for name in CONFIG_AXES if getattr(self, name)]
+        names = [name for name, _ in axes] + ["payload_size", "repetition"]
+        values = [values for _, values in axes] + [self.payload_sizes, range(self.repetitions)]
+        return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def point_filename(point: Dict[str, int]) -> str:
+    parts = [f"payload{point['payload_size']}"]
+    parts += [f"{AXIS_LABELS[name]}{point[name]}" for name in CONFIG_AXES if name in point]
+    parts.append(f"rep{point['repetition']}")
+    return "_".join(parts) + ".txt"
+
+
+def run_sweep(spec: SweepSpec, client: Optional[DeviceClient] = None, log=print) -> List[Dict]:
+    """Run every sweep point over one connection and return the run summaries."""
+    owns_client = client is None
+    if owns_client:
+        client = DeviceClient(port=spec.port)
+    base = get_profile(spec.profile) if spec.profile else Profile("sweep", {})
+    device = DeviceConfiguration(client)
+    results = []
+    points = spec.points()
+    if spec.window_size > 1:
+        log(WINDOW_WARNING)
+    try:
+        for index, point in enumerate(points, 1):
+            profile = base.merged({CONFIG_AXES[name]: point[name] for name in CONFIG_AXES if name in point})
+            configured = True
+            # Only the parameters that differ from the device's current settings are sent, in one batch.
+            try:
+                confirmed = device.apply(profile)
+            except TimeoutError as exc:
+                log(f"[{index}/{len(points)}] configuration not confirmed: {exc}")
+                configured = False
+                device.invalidate()
+            else:
+                for response in confirmed:
+                    name = parameter_name(response.group, response.parameter)
+                    if response.value != profile.settings[name]:
+                        log(f"[{index}/{len(points)}] device set {name} to {response.value} instead of {profile.settings[name]}")
+                        configured = False
+
+            output_path = spec.output_dir / point_filename(point)
+            session = ExperimentSession(
+                client,
+                output_path,
+                point["payload_size"],
+                window_size=spec.window_size,
+                timeout=spec.timeout,
+                destination=spec.destination,
+                max_frames=spec.frames_per_run,
+            )
+            session.start()
+            session.wait(spec.max_run_seconds)
+            summary = session.stop()
+            summary.update(point=point, output=str(output_path), configured=configured)
+            results.append(summary)
+            log(f"[{index}/{len(points)}] {output_path.name}: acked {summary['acked']}, timeouts {summary['timeouts']}, mean RTT {summary['rtt_mean_ms']:.2f} ms")
+    finally:
+        device.close()
+        if owns_client:
+            client.close()
+
+    spec.output_dir.mkdir(parents=True, exist_ok=True)
+    (spec.output_dir / "sweep_summary.json").write_text(json.dumps(results, indent=2))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an RTT parameter sweep without the Tk control panel.")
+    parser.add_argument("spec", help="JSON file with the SweepSpec fields")
+    parser.add_argument("--port", help="override the serial port from the spec")
+    parser.add_argument("--dry-run", action="store_true", help="only list the sweep points")
+    args = parser.parse_args(argv)
+
+    spec = SweepSpec.load(args.spec)
+    if args.port:
+        spec.port = args.port
+    if args.dry_run:
+        for point in spec.points():
+            print(point_filename(point))
+        return 0
+    run_sweep(spec)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+from device_client import DeviceClient
+from experiment_session import ExperimentSession
+from inflight import ACKED, DUPLICATE, LATE, InFlightTable
+from log_sink import LogSink
+from simulated_device import SimulatedDevice
+
+MS = 1_000_000
+
+
+def test_lost_frame_does_not_take_later_acks():
+    table = InFlightTable(late_grace_ns=200 * MS)
+    now = 0
+    outcomes = []
+    for frame_id in range(12):
+        table.open(frame_id, now)
+        if frame_id == 3:
+            now += 201 * MS
+            assert table.expire(200 * MS, now) == [3]
+            continue
+        now += 10 * MS
+        outcomes.append(table.ack(now))
+    assert [outcome for outcome, _, _ in outcomes] == [ACKED] * 11
+    assert [frame_id for _, frame_id, _ in outcomes] == [0, 1, 2] + list(range(4, 12))
+    assert all(rtt == 10 * MS for _, _, rtt in outcomes)
+    assert table.late == []
+
+
+def test_lost_frame_in_a_window_shifts_later_acks():
+    # Known limitation: ACKs name no frame, so with several frames in flight a
+    # lost one takes the ACK of the frame behind it and the newest frame times out.
+    table = InFlightTable(late_grace_ns=200 * MS)
+    for frame_id in range(4):
+        table.open(frame_id, frame_id * MS)
+    # Frame 1 is lost; the device acknowledges 0, 2 and 3.
+    outcomes = [table.ack(received * MS) for received in (10, 12, 13)]
+    assert [(outcome, frame_id) for outcome, frame_id, _ in outcomes] == [(ACKED, 0), (ACKED, 1), (ACKED, 2)]
+    assert table.expire(200 * MS, 204 * MS) == [3]
+
+
+def test_late_ack_for_evicted_frame():
+    table = InFlightTable(late_grace_ns=200 * MS)
+    table.open(0, 0)
+    assert table.ack(10 * MS)[0] == ACKED
+    table.open(1, 20 * MS)
+    assert table.expire(200 * MS, 221 * MS) == [1]
+
+    # Nothing open: the ACK can only belong to the evicted frame.
+    assert table.ack(230 * MS) == (LATE, 1, 210 * MS)
+
+    table.open(2, 240 * MS)
+    assert table.expire(200 * MS, 441 * MS) == [2]
+    table.open(3, 450 * MS)
+    # Far below the shortest RTT after frame 3 went out: the evicted frame's ACK.
+    assert table.ack(451 * MS)[:2] == (LATE, 2)
+    assert table.ack(460 * MS) == (ACKED, 3, 10 * MS)
+    assert table.ack(470 * MS)[0] == DUPLICATE
+
+
+class _DropOneDevice(SimulatedDevice):
+
+    def __init__(self, drop: int, **kwargs):
+        super().__init__(**kwargs)
+        self.drop = drop
+
+    def _transmit(self, message, destination):
+        if self.frames_sent == self.drop:
+            self.frames_sent += 1
+            self.frames_lost += 1
+            return
+        super()._transmit(message, destination)
+
+
+def test_session_keeps_measuring_after_a_lost_frame(tmp_path):
+    device = _DropOneDevice(drop=3, latency=0.01)
+    log_sink = LogSink(tmp_path / "log.txt")
+    client = DeviceClient(transport=device.loopback(timeout=0.05), log_sink=log_sink)
+    try:
+        session = ExperimentSession(client, tmp_path / "run.txt", 1, timeout=0.2, max_frames=12)
+        session.start()
+        assert session.wait(10)
+        summary = session.stop()
+    finally:
+        client.close()
+        device.close()
+        log_sink.close()
+    assert summary["acked"] == 11
+    assert summary["timeouts"] == 1
+    assert summary["late"] == 0
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import tkinter as tk
+from collections import deque
+from typing import Callable, Deque, Hashable, List, Optional, Tuple
+
+from log_sink import LogSink
+
+
+class EventBridge:
+	"""Hands work from background threads to the Tk main loop at a fixed rate.
+
+	post() and post_latest() may be called from any thread. They only
+	append to a deque, so a serial reader or sender thread never waits on
+	the GUI and never touches Tk itself. Every interval_ms the Tk thread
+	drains everything queued: posted calls run in order, and of several
+	post_latest() calls with the same key only the newest one runs, so a
+	counter updated per frame costs one widget update per interval. Drain
+	hooks (e.g. BoundedTextView) run after each drain.
+	"""
+
+	def __init__(self, widget: tk.Misc, interval_ms: int = 50):
+		self.widget = widget
+		self.interval_ms = interval_ms
+		self._pending: Deque[Tuple[Optional[Hashable], Callable, tuple]] = deque()
+		self._hooks: List[Callable[[], None]] = []
+		self._closed = False
+		self.widget.after(self.interval_ms, self._drain)
+
+	def post(self, callback: Callable, *args):
+		self._pending.append((None, callback, args))
+
+	def post_latest(self, key: Hashable, callback: Callable, *args):
+		self._pending.append((key, callback, args))
+
+	def add_drain_hook(self, hook: Callable[[], None]):
+		self._hooks.append(hook)
+
+	def close(self):
+		self._closed = True
+
+	def _drain(self):
+		if self._closed:
+			return
+		try:
+			batch = []
+			try:
+				while True:
+					batch.append(self._pending.popleft())
+			except IndexError:
+				pass
+			latest = {key: index for index, (key, _, _) in enumerate(batch) if key is not None}
+			for index, (key, callback, args) in enumerate(batch):
+				if key is None or latest[key] == index:
+					callback(*args)
+			for hook in self._hooks:
+				hook()
+		finally:
+			self.widget.after(self.interval_ms, self._drain)
+
+
+class BoundedTextView:
+	"""Append-only view over a read-only tk.Text that keeps at most max_lines.
+
+	append() may be called from any thread: it only puts the line on a
+	deque. On every drain of the EventBridge the Tk thread inserts the
+	whole batch with one insert call, trims the oldest lines and only
+	scrolls to the end if the view was already showing it. Lines pushed out
+	of the widget are not lost when an archive sink is given; every
+	appended line is written there as well.
+	"""
+
+	def __init__(self, text: tk.Text, bridge: EventBridge, max_lines: int = 2000, archive: Optional[LogSink] = None):
+		self.text = text
+		self.max_lines = max_lines
+		self.archive = archive
+		self._pending: Deque[Tuple[str, str]] = deque()
+		self._lines = 0
+		bridge.add_drain_hook(self._flush)
+
+	def append(self, line: str, tag: str = ""):
+		self._pending.append((line, tag))
+		if self.archive is not None:
+			self.archive.log(tag or "view", line)
+
+	def _flush(self):
+		if not self._pending:
+			return
+		batch = []
+		try:
+			while True:
+				batch.append(self._pending.popleft())
+		except IndexError:
+			pass
+		# Lines that would be trimmed right away are never inserted.
+		batch = batch[-self.max_lines:]
+
+		# One insert call for the batch: consecutive lines with the same tag form one chunk.
+		arguments = []
+		chunk = []
+		chunk_tag = batch[0][1]
+		for line, tag in batch:
+			if tag != chunk_tag:
+				arguments += ["".join(chunk), chunk_tag]
+				chunk = []
+				chunk_tag = tag
+			chunk.append(line if line.endswith("\n") else line + "\n")
+		arguments += ["".join(chunk), chunk_tag]
+
+		at_end = self.text.yview()[1] >= 1.0
+		self.text.configure(state="normal")
+		self.text.insert("end", *arguments)
+		self._lines += len(batch)
+		excess = self._lines - self.max_lines
+		if excess > 0:
+			self.text.delete("1.0", f"{excess + 1}.0")
+			self._lines = self.max_lines
+		self.text.configure(state="disabled")
+		if at_end:
+			self.text.see("end")